@@ -11,6 +11,12 @@ k近邻算法
 from numpy import *   #科学计算包
 import operator       #运算符模块
 from os import listdir
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
+from common.digits import packDigits, loadPackedDigits    #二进制打包的数字文件，供Ch02和Ch06共用
+from common.npzFile import npzName
 
 """
 作用：使用k近邻算法将每组数据划分到某个类中
@@ -27,17 +33,22 @@ inX：用于分类的输入向量
 dataSet：输入的训练样本集，行数是数据的个数，列数是数据集特征值的个数
 labels：标签向量，即分类的数目，标签向量的元素数目和矩阵dataSet的行数相同
 k：用于选择最近邻居的数目
+index：可选，nnIndex.buildIndex()在dataSet上预先建好的空间索引，给出时不再计算全部距离
 """
-def classify0(inX, dataSet, labels, k):
-    #距离计算
-    dataSetSize = dataSet.shape[0]   #NumPy中的shape方法用来查看矩阵或者数组的维数
-    diffMat = tile(inX, (dataSetSize, 1)) - dataSet
-    sqDiffMat = diffMat ** 2
-    sqDistances = sqDiffMat.sum(axis=1)
-    distances = sqDistances ** 0.5
+def classify0(inX, dataSet, labels, k, index=None):
+    if index is not None:
+        sortedDistIndicies = index.query(inX, k)[1]
+    else:
+        #距离计算
+        dataSetSize = dataSet.shape[0]   #NumPy中的shape方法用来查看矩阵或者数组的维数
+        diffMat = tile(inX, (dataSetSize, 1)) - dataSet
+        sqDiffMat = diffMat ** 2
+        sqDistances = sqDiffMat.sum(axis=1)
+        distances = sqDistances ** 0.5
 
-    #选择距离最小的k个点
-    sortedDistIndicies = distances.argsort()  #argsort()方法得到矩阵中每个元素的排序序号
+        #选择距离最小的k个点
+        #argsort()方法得到矩阵中每个元素的排序序号，稳定排序保证距离相同时下标小的在前，与索引结果一致
+        sortedDistIndicies = distances.argsort(kind='mergesort')
     classCount = {}
     for i in range(k):
         voteIlabel = labels[sortedDistIndicies[i]]
@@ -47,35 +58,161 @@ def classify0(inX, dataSet, labels, k):
     sortedClassCount = sorted(classCount.iteritems(), key=operator.itemgetter(1), reverse=True)
     return sortedClassCount[0][0]
 
+"""
+作用：一次对整个测试矩阵做k近邻分类
+距离用 ||a||^2 + ||b||^2 - 2ab 的展开式分块计算，每块是一次矩阵乘法，
+用argpartition只挑出每行最小的k个距离（不做完整排序），再用bincount统计投票。
+距离只用来比较大小，所以不再开平方。
+
+参数：
+queries：待分类的样本矩阵，每行一个样本
+dataSet、labels、k：与classify0相同
+maxBlockBytes：分块计算的临时内存上限。每块只有两个 行数 x 列数 的临时数组：
+               原地计算的float64距离块和argpartition返回的int64下标，
+               每个单元共16字节；另外只有每行2k个候选的小数组。
+               训练集很大时也会按列分块，因此不会生成完整的 查询数 x 训练样本数 距离矩阵
+返回：每个查询样本的预测类别组成的数组
+"""
+def classify_batch(queries, dataSet, labels, k, maxBlockBytes=64 * 2 ** 20):
+    queries = asarray(queries, dtype=float)
+    if queries.ndim == 1: queries = queries.reshape(1, -1)
+    dataSet = asarray(dataSet, dtype=float)
+    classes, labelIdx = unique(asarray(labels), return_inverse=True)
+    numClasses = len(classes)
+    m = dataSet.shape[0]; numQueries = queries.shape[0]
+    k = min(k, m)
+    dataSq = (dataSet ** 2).sum(axis=1)
+
+    #每块的行数和列数，保证 行数 x 列数 x 16字节（距离8字节 + argpartition下标8字节）不超过maxBlockBytes
+    maxCells = max(maxBlockBytes // 16, k)
+    colBlock = min(m, maxCells)
+    rowBlock = max(1, maxCells // colBlock)
+    distBuf = empty(rowBlock * colBlock)    #所有块共用，reshape后总是连续的，可以作为dot的out
+
+    predictions = zeros(numQueries, dtype=int)
+    for r0 in range(0, numQueries, rowBlock):
+        block = queries[r0:r0 + rowBlock]
+        n = block.shape[0]
+        rows = arange(n)[:, newaxis]
+        blockSq = (block ** 2).sum(axis=1)[:, newaxis]
+        bestDist = zeros((n, 0)); bestIdx = zeros((n, 0), dtype=int)
+        for c0 in range(0, m, colBlock):
+            c1 = min(c0 + colBlock, m)
+            dist = distBuf[:n * (c1 - c0)].reshape(n, c1 - c0)
+            dot(block, dataSet[c0:c1].T, out=dist)
+            dist *= -2.0; dist += blockSq; dist += dataSq[c0:c1]
+            #这一块中最小的k个，下标加上c0就是训练样本的下标
+            if c1 - c0 > k: nearest = argpartition(dist, k - 1, axis=1)[:, :k].copy()   #不让切片留住整块下标
+            else: nearest = tile(arange(c1 - c0), (n, 1))
+            #与上一块留下的k个候选合并，再选出最小的k个
+            candDist = hstack((bestDist, dist[rows, nearest]))
+            candIdx = hstack((bestIdx, nearest + c0))
+            if candDist.shape[1] > k:
+                nearest = argpartition(candDist, k - 1, axis=1)[:, :k]
+                candDist = candDist[rows, nearest]; candIdx = candIdx[rows, nearest]
+            bestDist = candDist; bestIdx = candIdx
+        votes = labelIdx[bestIdx] + rows * numClasses
+        classCount = bincount(votes.ravel(), minlength=n * numClasses).reshape(n, numClasses)
+        predictions[r0:r0 + n] = classCount.argmax(axis=1)
+    return classes[predictions]
+
 def createDataSet():
     group = array([[1.0,1.1],[1.0,1.0],[0,0],[0,0.1]])
     labels = ['A','A','B','B']
     return group, labels
 
 def file2matrix(filename):
-    fr = open(filename)
-    numberOfLines = len(fr.readlines())         #get the number of lines in the file
-    returnMat = zeros((numberOfLines,3))        #prepare matrix to return
-    classLabelVector = []                       #prepare labels return   
-    fr = open(filename)
-    index = 0
-    for line in fr.readlines():
-        line = line.strip()
-        listFromLine = line.split('\t')
-        returnMat[index,:] = listFromLine[0:3]
-        classLabelVector.append(int(listFromLine[-1]))
-        index += 1
-    return returnMat,classLabelVector
+    #只读一遍文件，直接解析进矩阵，最后一列是标签
+    returnMat, classLabels = loadTabDelimited(filename, usecols=[0,1,2], labelCol=-1, labelDtype=int)
+    return returnMat,classLabels.tolist()
     
 def autoNorm(dataSet):
     minVals = dataSet.min(0)
     maxVals = dataSet.max(0)
     ranges = maxVals - minVals
-    normDataSet = zeros(shape(dataSet))
-    m = dataSet.shape[0]
-    normDataSet = dataSet - tile(minVals, (m,1))
-    normDataSet = normDataSet/tile(ranges, (m,1))   #element wise divide
+    normDataSet = dataSet - minVals     #broadcast instead of tile()
+    normDataSet /= ranges               #element wise divide
     return normDataSet, ranges, minVals
+
+class Normalizer:
+    """
+    作用：流式的最小-最大归一化
+    新数据到来时只用这一批数据更新最小值和最大值（可选地同时更新均值和方差），
+    不需要重新扫描全部历史数据；统计量可以保存到文件，在线调用classify0前直接读取。
+
+    参数：
+    trackMoments：为True时同时维护均值和方差（Chan等人的分批合并公式）
+    """
+    def __init__(self, trackMoments=False):
+        self.trackMoments = trackMoments
+        self.count = 0
+        self.minVals = None; self.maxVals = None
+        self.meanVals = None; self.sqDevSum = None   #每个特征与均值之差的平方和
+
+    """
+    作用：用一批新样本更新统计量，代价只与这批样本的大小有关
+    """
+    def update(self, batch):
+        batch = asarray(batch, dtype=float)
+        if batch.ndim == 1: batch = batch.reshape(1, -1)
+        n = batch.shape[0]
+        if n == 0: return self
+        if self.count == 0:
+            self.minVals = batch.min(0); self.maxVals = batch.max(0)
+        else:
+            minimum(self.minVals, batch.min(0), out=self.minVals)
+            maximum(self.maxVals, batch.max(0), out=self.maxVals)
+        if self.trackMoments:
+            batchMean = batch.mean(0)
+            batchSqDev = ((batch - batchMean) ** 2).sum(0)
+            if self.count == 0:
+                self.meanVals = batchMean; self.sqDevSum = batchSqDev
+            else:
+                total = self.count + n
+                delta = batchMean - self.meanVals
+                self.meanVals += delta * (n / float(total))
+                self.sqDevSum += batchSqDev + delta ** 2 * (self.count * n / float(total))
+        self.count += n
+        return self
+
+    def ranges(self):
+        ranges = self.maxVals - self.minVals
+        ranges[ranges == 0] = 1.0      #常数特征归一化后为0，避免除以0
+        return ranges
+
+    def variance(self):
+        return self.sqDevSum / self.count
+
+    """
+    作用：按当前统计量归一化，不用tile，依靠广播逐元素计算
+    参数：
+    dataSet：待归一化的样本，可以是单个样本
+    out：输出数组；传入dataSet本身（浮点数组）即原地归一化，不分配新内存
+    """
+    def transform(self, dataSet, out=None):
+        if out is None: out = array(dataSet, dtype=float)
+        elif out is not dataSet: out[...] = dataSet
+        subtract(out, self.minVals, out=out)
+        divide(out, self.ranges(), out=out)
+        return out
+
+    def save(self, fileName):
+        state = {'count': array(self.count), 'minVals': self.minVals, 'maxVals': self.maxVals}
+        if self.trackMoments:
+            state['meanVals'] = self.meanVals; state['sqDevSum'] = self.sqDevSum
+        savez(fileName, **state)
+
+"""
+作用：读取Normalizer.save()保存的统计量
+"""
+def loadNormalizer(fileName):
+    state = load(npzName(fileName), allow_pickle=False)    #save(name)之后可以直接loadNormalizer(name)
+    normalizer = Normalizer('meanVals' in state.files)
+    normalizer.count = int(state['count'])
+    normalizer.minVals = state['minVals']; normalizer.maxVals = state['maxVals']
+    if normalizer.trackMoments:
+        normalizer.meanVals = state['meanVals']; normalizer.sqDevSum = state['sqDevSum']
+    return normalizer
    
 def datingClassTest():
     hoRatio = 0.50      #hold out 10%
@@ -84,8 +221,9 @@ def datingClassTest():
     m = normMat.shape[0]
     numTestVecs = int(m*hoRatio)
     errorCount = 0.0
+    classifierResults = classify_batch(normMat[:numTestVecs,:],normMat[numTestVecs:m,:],datingLabels[numTestVecs:m],3)
     for i in range(numTestVecs):
-        classifierResult = classify0(normMat[i,:],normMat[numTestVecs:m,:],datingLabels[numTestVecs:m],3)
+        classifierResult = classifierResults[i]
         print "the classifier came back with: %d, the real answer is: %d" % (classifierResult, datingLabels[i])
         if (classifierResult != datingLabels[i]): errorCount += 1.0
     print "the total error rate is: %f" % (errorCount/float(numTestVecs))
@@ -100,27 +238,143 @@ def img2vector(filename):
             returnVect[0,32*i+j] = int(lineStr[j])
     return returnVect
 
-def handwritingClassTest():
+"""
+作用：读取目录中所有32x32的数字文本文件，按文件名排序，与loadPackedDigits()的行顺序相同
+返回：每行一个1024维向量的矩阵，以及由文件名得到的标签列表
+"""
+def loadDigits(dirName):
     hwLabels = []
-    trainingFileList = listdir('trainingDigits')           #load the training set
-    m = len(trainingFileList)
-    trainingMat = zeros((m,1024))
+    fileList = sorted(listdir(dirName))
+    m = len(fileList)
+    digitMat = zeros((m,1024))
     for i in range(m):
-        fileNameStr = trainingFileList[i]
+        fileNameStr = fileList[i]
         fileStr = fileNameStr.split('.')[0]     #take off .txt
-        classNumStr = int(fileStr.split('_')[0])
-        hwLabels.append(classNumStr)
-        trainingMat[i,:] = img2vector('trainingDigits/%s' % fileNameStr)
-    testFileList = listdir('testDigits')        #iterate through the test set
+        hwLabels.append(int(fileStr.split('_')[0]))
+        digitMat[i,:] = img2vector('%s/%s' % (dirName, fileNameStr))
+    return digitMat, hwLabels
+
+def handwritingClassTest():
+    trainingMat, hwLabels = loadDigits('trainingDigits')           #load the training set
+    testMat, testLabels = loadDigits('testDigits')                 #iterate through the test set
     errorCount = 0.0
-    mTest = len(testFileList)
+    mTest = len(testLabels)
+    classifierResults = classify_batch(testMat, trainingMat, hwLabels, 3)
     for i in range(mTest):
-        fileNameStr = testFileList[i]
-        fileStr = fileNameStr.split('.')[0]     #take off .txt
-        classNumStr = int(fileStr.split('_')[0])
-        vectorUnderTest = img2vector('testDigits/%s' % fileNameStr)
-        classifierResult = classify0(vectorUnderTest, trainingMat, hwLabels, 3)
+        classNumStr = testLabels[i]
+        classifierResult = classifierResults[i]
         print "the classifier came back with: %d, the real answer is: %d" % (classifierResult, classNumStr)
         if (classifierResult != classNumStr): errorCount += 1.0
     print "\nthe total number of errors is: %d" % errorCount
-    print "\nthe total error rate is: %f" % (errorCount/float(mTest))
\ No newline at end of file
+    print "\nthe total error rate is: %f" % (errorCount/float(mTest))
+
+"""
+作用：在testDigits上比较近似搜索(nnIndex.LSHIndex)与精确的暴力搜索
+输出近似结果的recall@k（近似k近邻中真正属于精确k近邻的比例）、两者的错误率和加速比
+
+参数：
+numTables, numBits：LSHIndex的参数，用来在召回率和速度之间折中
+k：用于选择最近邻居的数目
+"""
+def handwritingANNTest(numTables=16, numBits=16, k=3, seed=0):
+    import time
+    import nnIndex
+    trainingMat, hwLabels = loadDigits('trainingDigits')
+    testMat, testLabels = loadDigits('testDigits')
+    mTest = len(testLabels)
+    startTime = time.time()
+    annIndex = nnIndex.LSHIndex(trainingMat, numTables, numBits, seed)
+    buildTime = time.time() - startTime
+    hits = 0
+    for i in range(mTest):
+        distances = (((trainingMat - testMat[i]) ** 2).sum(axis=1)) ** 0.5
+        exactNeighbours = distances.argsort(kind='mergesort')[:k]
+        hits += len(intersect1d(exactNeighbours, annIndex.query(testMat[i], k)[1]))
+    startTime = time.time()
+    exactResults = [classify0(testMat[i], trainingMat, hwLabels, k) for i in range(mTest)]
+    exactTime = time.time() - startTime
+    startTime = time.time()
+    annResults = [classify0(testMat[i], trainingMat, hwLabels, k, annIndex) for i in range(mTest)]
+    annTime = time.time() - startTime
+    exactErrors = sum(array(exactResults) != testLabels)
+    annErrors = sum(array(annResults) != testLabels)
+    print "recall@%d: %f" % (k, hits / float(k * mTest))
+    print "exact error rate: %f, approximate error rate: %f" % (exactErrors / float(mTest), annErrors / float(mTest))
+    print "index built in %.3fs, exact queries %.3fs, approximate queries %.3fs, speedup %.1fx" % \
+          (buildTime, exactTime, annTime, exactTime / annTime)
+
+#工作进程中通过memmap共享的训练集和测试集，由initShardWorker()打开
+sharedArrays = {}
+
+def initShardWorker(dirName):
+    for name in ('train', 'trainLabels', 'test', 'testLabels'):
+        sharedArrays[name] = load(os.path.join(dirName, name + '.npy'), mmap_mode='r')
+
+"""
+作用：在工作进程中对测试集的[start, end)行分类
+返回：这一片的错误数和混淆矩阵（行为真实类别，列为预测类别）
+"""
+def classifyShard(shard):
+    start, end, k, numClasses, maxBlockBytes = shard
+    trainLabels = sharedArrays['trainLabels']
+    testLabels = array(sharedArrays['testLabels'][start:end])
+    predictions = classify_batch(sharedArrays['test'][start:end], sharedArrays['train'],
+                                 trainLabels, k, maxBlockBytes)
+    #classify_batch返回的是训练标签中出现过的编码值
+    confusion = bincount(testLabels * numClasses + predictions,
+                         minlength=numClasses * numClasses).reshape(numClasses, numClasses)
+    return int((predictions != testLabels).sum()), confusion
+
+"""
+作用：用进程池并行完成留出法测试
+训练集（通常是autoNorm归一化后的矩阵）和测试集只写一次.npy文件，
+各工作进程用memmap只读打开，不会把矩阵pickle后发给每个进程。
+测试集被切成若干片分给各进程，最后合并每片的错误数和混淆矩阵。
+
+参数：
+testMat, testLabels：测试样本及其标签
+trainMat, trainLabels：训练样本及其标签
+k：用于选择最近邻居的数目
+numWorkers：进程数，默认为CPU核数
+shardSize：每片测试样本数，默认使每个进程分到约4片
+返回：错误率、混淆矩阵、混淆矩阵行列对应的类别
+"""
+def parallelClassTest(testMat, testLabels, trainMat, trainLabels, k=3, numWorkers=None,
+                      shardSize=None, maxBlockBytes=64 * 2 ** 20):
+    import multiprocessing, tempfile, shutil
+    if numWorkers is None: numWorkers = multiprocessing.cpu_count()
+    classes, codes = unique(concatenate((asarray(trainLabels), asarray(testLabels))),
+                            return_inverse=True)
+    numClasses = len(classes)
+    mTrain = shape(trainMat)[0]; mTest = shape(testMat)[0]
+    if shardSize is None: shardSize = max(1, int(ceil(mTest / float(4 * numWorkers))))
+    tmpDir = tempfile.mkdtemp(prefix='kNN')
+    try:
+        save(os.path.join(tmpDir, 'train.npy'), asarray(trainMat, dtype=float))
+        save(os.path.join(tmpDir, 'trainLabels.npy'), codes[:mTrain])
+        save(os.path.join(tmpDir, 'test.npy'), asarray(testMat, dtype=float))
+        save(os.path.join(tmpDir, 'testLabels.npy'), codes[mTrain:])
+        shards = [(start, min(start + shardSize, mTest), k, numClasses, maxBlockBytes)
+                  for start in range(0, mTest, shardSize)]
+        pool = multiprocessing.Pool(numWorkers, initShardWorker, (tmpDir,))
+        try:
+            errorCount = 0
+            confusion = zeros((numClasses, numClasses), dtype=int)
+            for shardErrors, shardConfusion in pool.imap_unordered(classifyShard, shards):
+                errorCount += shardErrors
+                confusion += shardConfusion
+        finally:
+            pool.close(); pool.join()
+    finally:
+        shutil.rmtree(tmpDir)
+    return errorCount / float(mTest), confusion, classes
+
+def handwritingClassTestParallel(numWorkers=None):
+    trainingMat, hwLabels = loadDigits('trainingDigits')
+    testMat, testLabels = loadDigits('testDigits')
+    errorRate, confusion, classes = parallelClassTest(testMat, testLabels, trainingMat, hwLabels,
+                                                      3, numWorkers)
+    print "the confusion matrix (rows are real answers %s):" % list(classes)
+    print confusion
+    print "\nthe total number of errors is: %d" % (confusion.sum() - confusion.trace())
+    print "\nthe total error rate is: %f" % errorRate
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+k近邻搜索的空间索引
+
+KDTree：按坐标轴中位数切分，适合低维数据（如约会数据的3个特征）
+BallTree：按超球体切分，适合高维数据（如img2vector得到的1024维手写数字向量）
+LSHIndex：局部敏感哈希，近似搜索，用召回率换速度
+
+KDTree和BallTree的query()与kNN.classify0的暴力搜索结果完全一致：
+距离用同样的公式计算，距离相同时下标小的样本排在前面。
+"""
+
+from numpy import *
+import heapq
+
+"""
+作用：把叶子节点中的候选样本加入大小为k的最大堆
+堆元素为(-距离, -下标)，堆顶就是当前第k近的样本
+"""
+def pushCandidates(heap, k, dists, rows):
+    for d, i in zip(dists, rows):
+        if len(heap) < k:
+            heapq.heappush(heap, (-d, -i))
+        elif d < -heap[0][0] or (d == -heap[0][0] and i < -heap[0][1]):
+            heapq.heapreplace(heap, (-d, -i))
+
+def worstDist(heap, k):
+    if len(heap) < k: return inf
+    return -heap[0][0]
+
+def heapResult(heap):
+    result = sorted((-d, -i) for d, i in heap)
+    return array([d for d, i in result]), array([i for d, i in result], dtype=int)
+
+class KDTree:
+    """
+    参数：
+    dataSet：训练样本矩阵，每行一个样本
+    leafSize：叶子节点中最多保存的样本数
+    """
+    def __init__(self, dataSet, leafSize=16):
+        self.data = asarray(dataSet, dtype=float)
+        self.leafSize = leafSize
+        self.idx = arange(self.data.shape[0])
+        #节点信息保存在平行的列表中：切分维度(-1表示叶子)、切分值、左右子节点、样本区间
+        self.splitDim = []; self.splitVal = []
+        self.left = []; self.right = []
+        self.start = []; self.end = []
+        self.build(0, self.data.shape[0])
+
+    def build(self, start, end):
+        node = len(self.splitDim)
+        self.splitDim.append(-1); self.splitVal.append(0.0)
+        self.left.append(-1); self.right.append(-1)
+        self.start.append(start); self.end.append(end)
+        if end - start <= self.leafSize: return node
+        rows = self.idx[start:end]
+        pts = self.data[rows]
+        spread = pts.max(0) - pts.min(0)
+        dim = spread.argmax()
+        if spread[dim] == 0: return node      #所有样本重合，无法再切分
+        mid = (end - start) // 2
+        order = argpartition(pts[:, dim], mid)
+        self.idx[start:end] = rows[order]
+        self.splitDim[node] = dim
+        self.splitVal[node] = self.data[self.idx[start + mid], dim]
+        self.left[node] = self.build(start, start + mid)
+        self.right[node] = self.build(start + mid, end)
+        return node
+
+    """
+    作用：查找inX的k个最近邻
+    返回：按距离递增排列的距离数组和样本下标数组
+    """
+    def query(self, inX, k):
+        x = asarray(inX, dtype=float).ravel()
+        heap = []
+        self.search(0, x, k, heap)
+        return heapResult(heap)
+
+    def search(self, node, x, k, heap):
+        dim = self.splitDim[node]
+        if dim < 0:
+            rows = self.idx[self.start[node]:self.end[node]]
+            diffMat = self.data[rows] - x
+            dists = ((diffMat ** 2).sum(axis=1)) ** 0.5
+            pushCandidates(heap, k, dists, rows)
+            return
+        diff = x[dim] - self.splitVal[node]
+        if diff <= 0: near, far = self.left[node], self.right[node]
+        else: near, far = self.right[node], self.left[node]
+        self.search(near, x, k, heap)
+        #与样本距离使用同样的浮点运算，保证下界不会大于真实距离
+        bound = (diff * diff) ** 0.5
+        if bound <= worstDist(heap, k):
+            self.search(far, x, k, heap)
+
+class BallTree:
+    """
+    参数：
+    dataSet：训练样本矩阵，每行一个样本
+    leafSize：叶子节点中最多保存的样本数
+    """
+    def __init__(self, dataSet, leafSize=32):
+        self.data = asarray(dataSet, dtype=float)
+        self.leafSize = leafSize
+        self.idx = arange(self.data.shape[0])
+        #节点信息：球心、半径、左右子节点(-1表示叶子)、样本区间
+        self.centers = []; self.radius = []
+        self.left = []; self.right = []
+        self.start = []; self.end = []
+        self.build(0, self.data.shape[0])
+
+    def build(self, start, end):
+        node = len(self.centers)
+        rows = self.idx[start:end]
+        pts = self.data[rows]
+        center = pts.mean(0)
+        dists = (((pts - center) ** 2).sum(axis=1)) ** 0.5
+        self.centers.append(center); self.radius.append(dists.max())
+        self.left.append(-1); self.right.append(-1)
+        self.start.append(start); self.end.append(end)
+        if end - start <= self.leafSize: return node
+        #取离球心最远的点a，再取离a最远的点b，沿a-b方向按中位数切分
+        a = pts[dists.argmax()]
+        b = pts[(((pts - a) ** 2).sum(axis=1)).argmax()]
+        proj = dot(pts, b - a)
+        if proj.max() == proj.min(): return node
+        mid = (end - start) // 2
+        order = argpartition(proj, mid)
+        self.idx[start:end] = rows[order]
+        self.left[node] = self.build(start, start + mid)
+        self.right[node] = self.build(start + mid, end)
+        return node
+
+    """
+    作用：查找inX的k个最近邻
+    返回：按距离递增排列的距离数组和样本下标数组
+    """
+    def query(self, inX, k):
+        x = asarray(inX, dtype=float).ravel()
+        heap = []
+        self.search(0, self.centerDist(0, x), x, k, heap)
+        return heapResult(heap)
+
+    def centerDist(self, node, x):
+        return (((self.centers[node] - x) ** 2).sum()) ** 0.5
+
+    def search(self, node, dCenter, x, k, heap):
+        #三角不等式给出的下界，留一点余量抵消浮点误差
+        bound = dCenter - self.radius[node]
+        if bound - 1e-9 * (dCenter + self.radius[node]) > worstDist(heap, k): return
+        if self.left[node] < 0:
+            rows = self.idx[self.start[node]:self.end[node]]
+            diffMat = self.data[rows] - x
+            dists = ((diffMat ** 2).sum(axis=1)) ** 0.5
+            pushCandidates(heap, k, dists, rows)
+            return
+        dLeft = self.centerDist(self.left[node], x)
+        dRight = self.centerDist(self.right[node], x)
+        if dLeft <= dRight:
+            self.search(self.left[node], dLeft, x, k, heap)
+            self.search(self.right[node], dRight, x, k, heap)
+        else:
+            self.search(self.right[node], dRight, x, k, heap)
+            self.search(self.left[node], dLeft, x, k, heap)
+
+class LSHIndex:
+    """
+    近似k近邻索引
+    0/1像素向量（如img2vector的结果）使用比特采样哈希：每张哈希表随机抽取numBits个像素，
+    两个样本的汉明距离越小，落进同一个桶的概率越大；
+    其他数据使用随机超平面哈希：取去中心化后的样本在numBits个随机方向上投影的符号。
+    查询时把各张表中与查询样本同桶的样本合并为候选集，再在候选集上精确计算距离。
+
+    参数：
+    dataSet：训练样本矩阵，每行一个样本
+    numTables：哈希表个数，越多召回率越高，查询越慢
+    numBits：每张表的哈希位数，越少桶越大，召回率越高，查询越慢
+    seed：随机数种子
+    """
+    def __init__(self, dataSet, numTables=16, numBits=16, seed=None):
+        self.data = asarray(dataSet, dtype=float)
+        rng = random.RandomState(seed)
+        m, n = self.data.shape
+        self.binary = bool(((self.data == 0) | (self.data == 1)).all())
+        self.weights = 2 ** arange(numBits, dtype=int64)
+        self.tables = []
+        if self.binary:
+            #只在取值有变化的像素中采样，四周恒为0的像素对哈希没有帮助
+            informative = nonzero(self.data.min(0) != self.data.max(0))[0]
+            if len(informative) == 0: informative = arange(n)
+            self.planes = [rng.choice(informative, numBits, replace=len(informative) < numBits)
+                           for t in range(numTables)]
+            self.center = None
+        else:
+            self.center = self.data.mean(0)
+            self.planes = [rng.randn(n, numBits) for t in range(numTables)]
+        for t in range(numTables):
+            keys = self.hashRows(self.data, t)
+            order = keys.argsort(kind='mergesort')
+            self.tables.append((keys[order], order))
+
+    def hashRows(self, rows, t):
+        if self.binary: bits = rows[:, self.planes[t]] > 0
+        else: bits = dot(rows - self.center, self.planes[t]) > 0
+        return dot(bits, self.weights)
+
+    """
+    作用：查找inX的k个近似最近邻
+    返回：按距离递增排列的距离数组和样本下标数组；候选不足k个时退化为暴力搜索
+    """
+    def query(self, inX, k):
+        x = asarray(inX, dtype=float).reshape(1, -1)
+        candidates = []
+        for t in range(len(self.tables)):
+            sortedKeys, order = self.tables[t]
+            key = self.hashRows(x, t)[0]
+            lo = searchsorted(sortedKeys, key, 'left')
+            hi = searchsorted(sortedKeys, key, 'right')
+            candidates.append(order[lo:hi])
+        rows = unique(concatenate(candidates))
+        if len(rows) < k: rows = arange(self.data.shape[0])
+        diffMat = self.data[rows] - x
+        dists = ((diffMat ** 2).sum(axis=1)) ** 0.5
+        nearest = lexsort((rows, dists))[:k]
+        return dists[nearest], rows[nearest]
+
+"""
+作用：根据特征维数选择索引类型，低维用KD树，高维用球树
+"""
+def buildIndex(dataSet, leafSize=None, maxKDDim=20):
+    n = shape(dataSet)[1]
+    if n <= maxKDDim:
+        if leafSize is None: leafSize = 16
+        return KDTree(dataSet, leafSize)
+    if leafSize is None: leafSize = 32
+    return BallTree(dataSet, leafSize)
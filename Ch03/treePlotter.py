@@ -71,6 +71,100 @@ def createPlot(inTree):
     plotTree(inTree, (0.5,1.0), '')
     plt.show()
 
+def annotateTree(myTree, info):    #leaf count and depth of every decision node, computed once
+    numLeafs = 0; maxDepth = 0
+    secondDict = myTree[myTree.keys()[0]]
+    for key in secondDict.keys():
+        if isinstance(secondDict[key], dict):
+            childLeafs, childDepth = annotateTree(secondDict[key], info)
+            numLeafs += childLeafs; thisDepth = 1 + childDepth
+        else: numLeafs += 1; thisDepth = 1
+        if thisDepth > maxDepth: maxDepth = thisDepth
+    info[id(myTree)] = (numLeafs, maxDepth)
+    return numLeafs, maxDepth
+
+def layoutTree(inTree):
+    '''
+    places every node the way createPlot does, but reads the leaf counts from
+    one annotation pass instead of recomputing them at every node.
+    returns nodes as (text, x, y, isLeaf, numLeafs, depth) and edges as
+    (parentPt, childPt, edgeText), all in axes fraction coordinates
+    '''
+    if not isinstance(inTree, dict): return [(inTree, 0.5, 0.5, True, 1, 0)], []
+    info = {}
+    totalW, totalD = annotateTree(inTree, info)
+    totalW = float(totalW); totalD = float(totalD)
+    nodes = []; edges = []
+    offsets = {'x': -0.5/totalW, 'y': 1.0}
+    def placeNode(myTree, parentPt, nodeTxt):
+        numLeafs, depth = info[id(myTree)]
+        firstStr = myTree.keys()[0]
+        cntrPt = (offsets['x'] + (1.0 + numLeafs)/2.0/totalW, offsets['y'])
+        nodes.append((firstStr, cntrPt[0], cntrPt[1], False, numLeafs, depth))
+        if parentPt is not None: edges.append((parentPt, cntrPt, nodeTxt))
+        secondDict = myTree[firstStr]
+        offsets['y'] -= 1.0/totalD
+        for key in secondDict.keys():
+            if isinstance(secondDict[key], dict):
+                placeNode(secondDict[key], cntrPt, str(key))
+            else:
+                offsets['x'] += 1.0/totalW
+                leafPt = (offsets['x'], offsets['y'])
+                nodes.append((secondDict[key], leafPt[0], leafPt[1], True, 1, 0))
+                edges.append((cntrPt, leafPt, str(key)))
+        offsets['y'] += 1.0/totalD
+    placeNode(inTree, None, '')
+    return nodes, edges
+
+def addTextCollections(ax, labels, size, rotation=0):    #one PathCollection per distinct string
+    from matplotlib.textpath import TextPath
+    from matplotlib.collections import PathCollection
+    from matplotlib.transforms import Affine2D
+    positions = {}
+    for txt, x, y in labels: positions.setdefault(txt, []).append((x, y))
+    toPixels = Affine2D().scale(ax.figure.dpi/72.0)     #TextPath is in points
+    for txt, pts in positions.items():
+        path = TextPath((0, 0), txt, size=size)
+        ext = path.get_extents()
+        centered = Affine2D().translate(-(ext.x0 + ext.x1)/2.0, -(ext.y0 + ext.y1)/2.0).rotate_deg(rotation)
+        coll = PathCollection([path.transformed(centered)], offsets=pts, transOffset=ax.transData,
+                              facecolors='k', edgecolors='none', zorder=3)
+        coll.set_transform(toPixels)
+        ax.add_collection(coll)
+
+def drawLayout(ax, nodes, edges, showEdgeText=True):    #one collection per artist type or label
+    from matplotlib.collections import LineCollection
+    ax.add_collection(LineCollection([(p, c) for p, c, txt in edges], colors='k', linewidths=0.8, zorder=1))
+    for isLeaf, marker, style in ((False, 's', decisionNode), (True, 'o', leafNode)):
+        xs = [x for txt, x, y, leaf, n, d in nodes if leaf == isLeaf]
+        ys = [y for txt, x, y, leaf, n, d in nodes if leaf == isLeaf]
+        if xs: ax.scatter(xs, ys, s=300, marker=marker, c=style['fc'], edgecolors='k', zorder=2)
+    addTextCollections(ax, [(str(txt), x, y) for txt, x, y, leaf, n, d in nodes], 8)
+    if showEdgeText:
+        addTextCollections(ax, [(txt, (px + cx)/2.0, (py + cy)/2.0) for (px, py), (cx, cy), txt in edges if txt],
+                           7, rotation=30)
+    ax.set_xlim(0.0, 1.0); ax.set_ylim(min([y for txt, x, y, leaf, n, d in nodes]) - 0.05, 1.05)
+
+def createPlotFast(inTree, fileName=None, figSize=(8, 6), showEdgeText=True):
+    '''
+    single layout pass plus batched drawing; with a fileName the tree is rendered
+    by the Agg canvas straight to the file, so no display is needed
+    '''
+    nodes, edges = layoutTree(inTree)
+    if fileName is None:
+        fig = plt.figure(1, facecolor='white', figsize=figSize)
+        fig.clf()
+    else:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(facecolor='white', figsize=figSize)
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111, frameon=False, xticks=[], yticks=[])
+    drawLayout(ax, nodes, edges, showEdgeText)
+    if fileName is None: plt.show()
+    else: fig.savefig(fileName, facecolor='white')
+    return nodes, edges
+
 #def createPlot():
 #    fig = plt.figure(1, facecolor='white')
 #    fig.clf()
@@ -3,8 +3,12 @@ Created on Oct 12, 2010
 Decision Tree Source Code for Machine Learning in Action Ch. 3
 @author: Peter Harrington
 '''
-from math import log
+from numpy import *
+from math import log     #after numpy so that log(x,2) is math.log
 import operator
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.treeFormat import writeTreeFile, readTreeFile
 
 def createDataSet():
     dataSet = [[1, 1, 'yes'],
@@ -81,6 +85,157 @@ def createTree(dataSet,labels):
         myTree[bestFeatLabel][value] = createTree(splitDataSet(dataSet, bestFeat, value),subLabels)
     return myTree                            
     
+def expandTreeParallel(dataSet, labels, pool, splitThreshold):
+    if len(dataSet) <= splitThreshold:  #small enough: one task builds the whole subtree
+        return pool.apply_async(createTree, (dataSet, labels))
+    classList = [example[-1] for example in dataSet]
+    if classList.count(classList[0]) == len(classList): 
+        return classList[0]#stop splitting when all of the classes are equal
+    if len(dataSet[0]) == 1: #stop splitting when there are no more features in dataSet
+        return majorityCnt(classList)
+    bestFeat = chooseBestFeatureToSplit(dataSet)
+    bestFeatLabel = labels[bestFeat]
+    myTree = {bestFeatLabel:{}}
+    del(labels[bestFeat])
+    featValues = [example[bestFeat] for example in dataSet]
+    uniqueVals = set(featValues)
+    for value in uniqueVals:
+        subLabels = labels[:]       #copy all of labels, so trees don't mess up existing labels
+        myTree[bestFeatLabel][value] = expandTreeParallel(splitDataSet(dataSet, bestFeat, value),
+                                                          subLabels, pool, splitThreshold)
+    return myTree
+
+def collectSubtrees(myTree):    #replace the pending task results with the finished subtrees
+    if isinstance(myTree, dict):
+        secondDict = myTree.values()[0]
+        for key in secondDict.keys():
+            secondDict[key] = collectSubtrees(secondDict[key])
+        return myTree
+    if hasattr(myTree, 'get') and hasattr(myTree, 'ready'): return myTree.get()
+    return myTree
+
+def createTreeParallel(dataSet, labels, numWorkers=None, splitThreshold=None):
+    '''
+    builds the same tree as createTree with a pool of worker processes:
+    nodes with more than splitThreshold rows are split here and their branches
+    scheduled in turn, smaller subtrees are built by createTree in a worker.
+    the default threshold gives each worker about four tasks, so one large
+    branch gets split further instead of keeping a single core busy.
+    '''
+    import multiprocessing
+    if numWorkers is None: numWorkers = multiprocessing.cpu_count()
+    if splitThreshold is None: splitThreshold = max(1, len(dataSet) // (4 * numWorkers))
+    pool = multiprocessing.Pool(numWorkers)
+    try:
+        myTree = collectSubtrees(expandTreeParallel(dataSet, labels, pool, splitThreshold))
+    finally:
+        pool.close(); pool.join()
+    return myTree
+
+def encodeDataSet(dataSet):    #integer-encode every column (features and class) once
+    numCols = len(dataSet[0])
+    codes = zeros((len(dataSet), numCols), dtype=int32); colValues = []
+    for col in range(numCols):
+        valueIndex = {}
+        codes[:, col] = [valueIndex.setdefault(example[col], len(valueIndex)) for example in dataSet]
+        values = [None] * len(valueIndex)
+        for value, code in valueIndex.items(): values[code] = value
+        colValues.append(values)
+    return codes, colValues
+
+def firstSeen(col, numDistinct):
+    '''
+    the numDistinct distinct codes of col in order of first occurrence;
+    they nearly always all show up early, so only a growing prefix is sorted
+    '''
+    size = 256
+    while True:
+        vals, first = unique(col[:size], return_index=True)
+        if len(vals) == numDistinct or size >= len(col): return vals[first.argsort()]
+        size *= 4
+
+def entropyInOrder(classCodes, counts, classValues, numEntries):
+    '''
+    calcShannonEnt from counts: the terms are added in the order calcShannonEnt's dict
+    yields them, a dict filled in order of first occurrence, so the rounding is the same
+    '''
+    labelCounts = {}
+    for c in classCodes: labelCounts[classValues[c]] = int(counts[c])
+    shannonEnt = 0.0
+    for key in labelCounts:
+        prob = float(labelCounts[key])/numEntries
+        shannonEnt -= prob * log(prob,2) #log base 2
+    return shannonEnt
+
+def chooseBestFeatureCounts(codes, rows, feats, colValues, numValues):
+    '''
+    chooseBestFeatureToSplit on the rows at this node: counts come from bincount
+    contingency tables, the gains are then summed term by term in the same order as
+    chooseBestFeatureToSplit (set and dict iteration order), so equal gains tie the same way
+    '''
+    classValues = colValues[-1]; numClasses = len(classValues)
+    classCol = codes[rows, -1]
+    numEntries = len(rows)
+    classCounts = bincount(classCol, minlength=numClasses)
+    baseEntropy = entropyInOrder(firstSeen(classCol, count_nonzero(classCounts)), classCounts,
+                                 classValues, numEntries)
+    bestInfoGain = 0.0; bestPos = -1
+    for pos in range(len(feats)):
+        f = feats[pos]
+        #contingency table of feature value x class for the rows at this node
+        pairs = codes[rows, f] * numClasses + classCol
+        table = bincount(pairs, minlength=numValues[f] * numClasses).reshape(numValues[f], numClasses)
+        #a value first occurs with its first pair, so one pass gives both orders
+        valueOrder = []; subClasses = {}    #value code -> its classes in order of first occurrence
+        for pair in firstSeen(pairs, count_nonzero(table)):
+            v = pair // numClasses
+            if v not in subClasses: valueOrder.append(v); subClasses[v] = []
+            subClasses[v].append(pair % numClasses)
+        codeOf = dict((colValues[f][v], v) for v in valueOrder)
+        uniqueVals = set(colValues[f][v] for v in valueOrder)
+        newEntropy = 0.0
+        for value in uniqueVals:
+            v = codeOf[value]; subCount = int(table[v].sum())
+            prob = subCount/float(numEntries)
+            newEntropy += prob * entropyInOrder(subClasses[v], table[v], classValues, subCount)
+        infoGain = baseEntropy - newEntropy
+        if (infoGain > bestInfoGain):
+            bestInfoGain = infoGain
+            bestPos = pos
+    return bestPos
+
+def buildTreeCounts(codes, rows, feats, labels, colValues, numValues):
+    classCol = codes[rows, -1]
+    classValues = colValues[-1]
+    if (classCol == classCol[0]).all():
+        return classValues[classCol[0]]#stop splitting when all of the classes are equal
+    if len(feats) == 0: #stop splitting when there are no more features
+        return majorityCnt([classValues[c] for c in classCol])
+    bestPos = chooseBestFeatureCounts(codes, rows, feats, colValues, numValues)
+    if bestPos < 0:     #no gain: createTree then splits on index -1, the class column, under the last label
+        return {labels[feats[-1]]:dict((classValues[c], classValues[c]) for c in unique(classCol))}
+    bestFeat = feats[bestPos]
+    subFeats = feats[:bestPos] + feats[bestPos+1:]
+    myTree = {labels[bestFeat]:{}}
+    featCol = codes[rows, bestFeat]
+    valueCounts = bincount(featCol, minlength=numValues[bestFeat])
+    groups = split(rows[featCol.argsort(kind='mergesort')], cumsum(valueCounts)[:-1])
+    for value in nonzero(valueCounts)[0]:
+        myTree[labels[bestFeat]][colValues[bestFeat][value]] = \
+            buildTreeCounts(codes, groups[value], subFeats, labels, colValues, numValues)
+    return myTree
+
+def createTreeFast(dataSet,labels):
+    '''
+    builds the same tree as createTree from counts instead of copied sublists:
+    the columns are integer encoded once, information gain comes from bincount
+    contingency tables and the recursion passes arrays of row indices.
+    labels is not modified.
+    '''
+    codes, colValues = encodeDataSet(dataSet)
+    numValues = [len(values) for values in colValues]
+    return buildTreeCounts(codes, arange(len(dataSet)), range(len(labels)), labels, colValues, numValues)
+
 def classify(inputTree,featLabels,testVec):
     firstStr = inputTree.keys()[0]
     secondDict = inputTree[firstStr]
@@ -92,14 +247,136 @@ def classify(inputTree,featLabels,testVec):
     else: classLabel = valueOfFeat
     return classLabel
 
-def storeTree(inputTree,filename):
-    import pickle
-    fw = open(filename,'w')
-    pickle.dump(inputTree,fw)
-    fw.close()
-    
+class CompiledTree:
+    def __init__(self):
+        self.featNames = []     #feature labels split on somewhere in the tree
+        self.featValues = []    #per feature: list of the values seen in the tree
+        self.classes = []       #distinct leaf labels
+        #decision nodes are numbered 0..I-1 and leaves I..N-1, the root is node 0
+        self.nodeFeat = None    #per decision node: index into featNames
+        #children in CSR form: the edges of decision node i are childStart[i]:childStart[i+1],
+        #sorted by value code, so a node only costs as many entries as it has branches
+        self.childStart = None  #per decision node, plus one at the end: offset of its first edge
+        self.childValue = None  #per edge: value code of the feature
+        self.childNode = None   #per edge: child node
+        self.leafClass = None   #per leaf: index into classes
+
+def smallestInt(values):    #compact dtype for an array of small non-negative ints (and -1)
+    values = asarray(values)
+    top = values.max() if len(values) > 0 else 0
+    if top < 2 ** 7: return values.astype(int8)
+    if top < 2 ** 15: return values.astype(int16)
+    return values.astype(int32)
+
+def compileTree(inputTree):    #flatten the nested dict into parallel arrays
+    ct = CompiledTree()
+    featIndex = {}; valueIndex = []; classIndex = {}
+    nodeFeat = []; leafClass = []; edges = []
+    stack = [(inputTree, -1, None)]   #(subtree, parent decision node, feature value leading to it)
+    while stack:
+        tree, parent, value = stack.pop()
+        if isinstance(tree, dict):
+            node = ('decision', len(nodeFeat))
+            firstStr = tree.keys()[0]
+            if firstStr not in featIndex:
+                featIndex[firstStr] = len(ct.featNames)
+                ct.featNames.append(firstStr); ct.featValues.append([]); valueIndex.append({})
+            fi = featIndex[firstStr]
+            nodeFeat.append(fi)
+            for key, subTree in tree[firstStr].items():
+                if key not in valueIndex[fi]:
+                    valueIndex[fi][key] = len(ct.featValues[fi]); ct.featValues[fi].append(key)
+                stack.append((subTree, node[1], (fi, key)))
+        else:
+            node = ('leaf', len(leafClass))
+            if tree not in classIndex:
+                classIndex[tree] = len(ct.classes); ct.classes.append(tree)
+            leafClass.append(classIndex[tree])
+        if parent >= 0: edges.append((parent, value, node))
+    numDecision = len(nodeFeat)
+    parents = array([parent for parent, value, node in edges], dtype=int)
+    valueCodes = array([valueIndex[fi][key] for parent, (fi, key), node in edges], dtype=int)
+    childNodes = array([k + numDecision if kind == 'leaf' else k for parent, value, (kind, k) in edges], dtype=int)
+    order = lexsort((valueCodes, parents))
+    childStart = concatenate(([0], cumsum(bincount(parents, minlength=numDecision))))
+    ct.nodeFeat = smallestInt(nodeFeat); ct.leafClass = smallestInt(leafClass)
+    ct.childStart = smallestInt(childStart)
+    ct.childValue = smallestInt(valueCodes[order]); ct.childNode = smallestInt(childNodes[order])
+    return ct
+
+def findChildren(ct, nodes, codes):
+    '''
+    child of every decision node in nodes for the matching value code, -1 if the node has no such branch;
+    a binary search within each node's edge slice, all nodes in step
+    '''
+    lo = ct.childStart[nodes].astype(int); end = ct.childStart[nodes + 1].astype(int); hi = end.copy()
+    while True:
+        searching = lo < hi
+        if not searching.any(): break
+        mid = (lo + hi) // 2
+        goRight = searching & (ct.childValue[where(searching, mid, 0)] < codes)
+        lo = where(goRight, mid + 1, lo)
+        hi = where(searching & ~goRight, mid, hi)
+    found = lo < end
+    found[found] = ct.childValue[lo[found]] == codes[found]
+    return where(found, ct.childNode[where(found, lo, 0)], -1)    #a decision node always has an edge
+
+def encodeColumn(column, values):    #map raw feature values to value codes, -1 if unseen
+    column = asarray(column)
+    numericVals = [v for v in values if isinstance(v, (int, long, float))]
+    if column.dtype.kind in 'biuf' and len(numericVals) == len(values):
+        order = argsort(values); sortedVals = array(values)[order]
+        pos = clip(searchsorted(sortedVals, column), 0, len(values) - 1)
+        return where(sortedVals[pos] == column, order[pos], -1)
+    valueIndex = dict((v, i) for i, v in enumerate(values))
+    return array([valueIndex.get(v, -1) for v in column.tolist()], dtype=int)
+
+def classify_batch(compiledTree, featLabels, testMat):    #classify every row of testMat at once
+    ct = compiledTree
+    testMat = asarray(testMat, dtype=object) if isinstance(testMat, list) else asarray(testMat)
+    m = testMat.shape[0]
+    codes = zeros((m, max(len(ct.featNames), 1)), dtype=int)
+    for fi, featName in enumerate(ct.featNames):
+        codes[:, fi] = encodeColumn(testMat[:, featLabels.index(featName)], ct.featValues[fi])
+    numDecision = len(ct.nodeFeat)
+    node = zeros(m, dtype=int)
+    active = arange(m) if numDecision > 0 else arange(0)
+    while len(active) > 0:   #one step down the tree for every row still at a decision node
+        current = node[active]
+        feat = ct.nodeFeat[current]
+        code = codes[active, feat]
+        nextNode = findChildren(ct, current, code)   #-1 code (value unseen in training) finds nothing
+        if (nextNode < 0).any():
+            row = active[nonzero(nextNode < 0)[0][0]]
+            raise KeyError(testMat[row, featLabels.index(ct.featNames[ct.nodeFeat[node[row]]])])
+        node[active] = nextNode
+        active = active[nextNode < numDecision]
+    classes = empty(len(ct.classes), dtype=object); classes[:] = ct.classes
+    return classes[ct.leafClass[node - numDecision]].tolist()
+
+def storeTree(inputTree,filename):    #versioned binary format, see common/treeFormat.py
+    ct = compileTree(inputTree)
+    writeTreeFile(filename, 'id3',
+                  [('nodeFeat', ct.nodeFeat), ('childStart', ct.childStart), ('childValue', ct.childValue),
+                   ('childNode', ct.childNode), ('leafClass', ct.leafClass)],
+                  {'featNames': ct.featNames, 'featValues': ct.featValues, 'classes': ct.classes})
+
+def grabCompiledTree(filename):    #memory-mapped, ready for classify_batch without building dicts
+    meta, arrays = readTreeFile(filename, 'id3')
+    ct = CompiledTree()
+    ct.featNames = meta['featNames']; ct.featValues = meta['featValues']; ct.classes = meta['classes']
+    ct.nodeFeat = arrays['nodeFeat']; ct.leafClass = arrays['leafClass']
+    ct.childStart = arrays['childStart']; ct.childValue = arrays['childValue']; ct.childNode = arrays['childNode']
+    return ct
+
+def expandTree(compiledTree, node=0):    #back to the nested dict form used by classify and treePlotter
+    ct = compiledTree
+    if node >= len(ct.nodeFeat): return ct.classes[ct.leafClass[node - len(ct.nodeFeat)]]
+    fi = ct.nodeFeat[node]
+    secondDict = {}
+    for edge in range(ct.childStart[node], ct.childStart[node + 1]):
+        secondDict[ct.featValues[fi][ct.childValue[edge]]] = expandTree(ct, ct.childNode[edge])
+    return {ct.featNames[fi]:secondDict}
+
 def grabTree(filename):
-    import pickle
-    fr = open(filename)
-    return pickle.load(fr)
-    
+    return expandTree(grabCompiledTree(filename))
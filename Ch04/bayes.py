@@ -4,6 +4,10 @@ Created on Oct 19, 2010
 @author: Peter
 '''
 from numpy import *
+import os, sys
+import zlib
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tokenizer import tokenize, tokenizeFiles
 
 def loadDataSet():
     postingList=[['my', 'dog', 'has', 'flea', 'problems', 'help', 'please'],
@@ -54,6 +58,97 @@ def classifyNB(vec2Classify, p0Vec, p1Vec, pClass1):
     else: 
         return 0
     
+def trainNBSparse(trainMatrix, trainCategory):
+    """
+    trainMatrix: documents x words, dense array or scipy.sparse matrix (e.g. Vocabulary.transform)
+    trainCategory: one label per document, any number of classes
+    returns classes, logProb (classes x words), logPrior; same smoothing as trainNB0
+    """
+    from scipy.sparse import csr_matrix
+    classes, y = unique(asarray(trainCategory), return_inverse=True)
+    m = len(y)
+    if not hasattr(trainMatrix, 'tocsr'): trainMatrix = asarray(trainMatrix)
+    oneHot = csr_matrix((ones(m), (arange(m), y)), shape=(m, len(classes)))
+    counts = oneHot.T.dot(trainMatrix)      #class-conditional word counts in one product
+    if hasattr(counts, 'toarray'): counts = counts.toarray()
+    counts = asarray(counts, dtype=float)
+    logProb = log((counts + 1.0) / (counts.sum(axis=1) + 2.0)[:, newaxis])
+    logPrior = log(bincount(y) / float(m))
+    return classes, logProb, logPrior
+
+def scoreNB(testMatrix, logProb, logPrior):    #unnormalized log posteriors
+    if not hasattr(testMatrix, 'tocsr'): testMatrix = asarray(testMatrix, dtype=float)
+    return asarray(testMatrix.dot(logProb.T)) + logPrior
+
+def logPosterior(testMatrix, logProb, logPrior):    #normalized log P(class|doc), one row per document
+    scores = scoreNB(testMatrix, logProb, logPrior)
+    top = scores.max(axis=1)[:, newaxis]
+    return scores - (top + log(exp(scores - top).sum(axis=1))[:, newaxis])
+
+def classify_batch(testMatrix, classes, logProb, logPrior):
+    return classes[scoreNB(testMatrix, logProb, logPrior).argmax(axis=1)]
+
+class IncrementalNB:
+    """
+    Naive Bayes with the trainNB0 smoothing that can be updated with new documents
+    keeps raw word counts per class, so an update only touches the new documents;
+    new words and new classes may appear in any batch
+    the log probabilities are recomputed lazily, the first time the model scores after an update
+    """
+    def __init__(self, vocab=None):
+        if vocab is None: vocab = Vocabulary()
+        self.vocab = vocab
+        self.classes = []; self.classIndex = {}
+        self.wordCounts = zeros((1, 1))     #classes x words, with spare capacity in both directions
+        self.docCounts = zeros(1)
+        self.model = None
+
+    def reserve(self, numClasses, numWords):   #grow geometrically so updates stay amortized O(new data)
+        rows, cols = self.wordCounts.shape
+        if numClasses <= rows and numWords <= cols: return
+        newShape = (max(numClasses, 2 * rows if numClasses > rows else rows),
+                    max(numWords, 2 * cols if numWords > cols else cols))
+        wordCounts = zeros(newShape)
+        wordCounts[:rows, :cols] = self.wordCounts
+        self.wordCounts = wordCounts
+        docCounts = zeros(newShape[0])
+        docCounts[:rows] = self.docCounts
+        self.docCounts = docCounts
+
+    def partial_fit(self, docList, labels):
+        from scipy.sparse import csr_matrix
+        docMat = self.vocab.transform(docList, grow=True)
+        y = zeros(len(labels), dtype=int)
+        for i, label in enumerate(labels):
+            if label not in self.classIndex:
+                self.classIndex[label] = len(self.classes)
+                self.classes.append(label)
+            y[i] = self.classIndex[label]
+        self.reserve(len(self.classes), len(self.vocab))
+        oneHot = csr_matrix((ones(len(y)), (arange(len(y)), y)), shape=(len(y), len(self.classes)))
+        counts = oneHot.T.dot(docMat).tocoo()       #only the nonzero class/word pairs of this batch
+        self.wordCounts[counts.row, counts.col] += counts.data
+        self.docCounts[:len(self.classes)] += bincount(y, minlength=len(self.classes))
+        self.model = None
+        return self
+
+    def logProbabilities(self):    #classes, logProb, logPrior as returned by trainNBSparse
+        if self.model is None:
+            numClasses = len(self.classes); numWords = len(self.vocab)
+            counts = self.wordCounts[:numClasses, :numWords]
+            logProb = log((counts + 1.0) / (counts.sum(axis=1) + 2.0)[:, newaxis])
+            docCounts = self.docCounts[:numClasses]
+            self.model = (array(self.classes), logProb, log(docCounts / docCounts.sum()))
+        return self.model
+
+    def predict(self, docList):    #words not seen in training are ignored
+        classes, logProb, logPrior = self.logProbabilities()
+        return classify_batch(self.vocab.transform(docList), classes, logProb, logPrior)
+
+    def predictLogPosterior(self, docList):
+        classes, logProb, logPrior = self.logProbabilities()
+        return logPosterior(self.vocab.transform(docList), logProb, logPrior)
+
 def bagOfWords2VecMN(vocabList, inputSet):
     returnVec = [0]*len(vocabList)
     for word in inputSet:
@@ -61,6 +156,70 @@ def bagOfWords2VecMN(vocabList, inputSet):
             returnVec[vocabList.index(word)] += 1
     return returnVec
 
+class Vocabulary:
+    """
+    word -> column index in O(1)
+    numFeatures=None: exact dict index, grows as new words are added
+    numFeatures=n:    hashing trick, column is crc32(word) mod n, nothing is stored
+    """
+    def __init__(self, words=None, numFeatures=None):
+        self.numFeatures = numFeatures
+        self.index = {}; self.words = []
+        if words is not None:
+            for word in words: self.add(word)
+
+    def __len__(self):
+        if self.numFeatures is not None: return self.numFeatures
+        return len(self.words)
+
+    def add(self, word):
+        if self.numFeatures is not None: return self.hashWord(word)
+        col = self.index.get(word)
+        if col is None:
+            col = self.index[word] = len(self.words)
+            self.words.append(word)
+        return col
+
+    def hashWord(self, word):
+        if isinstance(word, unicode): word = word.encode('utf-8')
+        return (zlib.crc32(word) & 0xffffffff) % self.numFeatures
+
+    def lookup(self, word):    #-1 if the word is not in the vocabulary
+        if self.numFeatures is not None: return self.hashWord(word)
+        return self.index.get(word, -1)
+
+    def fit(self, docList):
+        for doc in docList:
+            for word in doc: self.add(word)
+        return self
+
+    def transform(self, docList, binary=False, grow=False):
+        """
+        one pass over the corpus, returns a scipy.sparse csr_matrix with one row per document
+        binary=True gives setOfWords2Vec rows, otherwise bagOfWords2VecMN counts
+        grow=True adds unseen words, otherwise they are skipped
+        """
+        from scipy.sparse import csr_matrix
+        from array import array as pyArray
+        indptr = pyArray('l', [0]); indices = pyArray('l'); data = pyArray('l')
+        add = self.add; lookup = self.lookup
+        for doc in docList:
+            counts = {}
+            for word in doc:
+                if grow: col = add(word)
+                else: col = lookup(word)
+                if col >= 0: counts[col] = counts.get(col, 0) + 1
+            cols = sorted(counts)
+            indices.extend(cols)
+            if binary: data.extend([1] * len(cols))
+            else: data.extend([counts[col] for col in cols])
+            indptr.append(len(indices))
+        return csr_matrix((array(data, dtype=int32), array(indices, dtype=int32), array(indptr, dtype=int32)),
+                          shape=(len(indptr) - 1, len(self)))
+
+    def fitTransform(self, docList, binary=False):
+        return self.transform(docList, binary, grow=True)
+
 def testingNB():
     listOPosts,listClasses = loadDataSet()
     myVocabList = createVocabList(listOPosts)
@@ -76,48 +235,37 @@ def testingNB():
     print testEntry,'classified as: ',classifyNB(thisDoc,p0V,p1V,pAb)
 
 def textParse(bigString):    #input is big string, #output is word list
-    import re
-    listOfTokens = re.split(r'\W*', bigString)
-    return [tok.lower() for tok in listOfTokens if len(tok) > 2] 
+    return tokenize(bigString)
     
 def spamTest():
     docList=[]; classList = []; fullText =[]
-    for i in range(1,26):
-        wordList = textParse(open('email/spam/%d.txt' % i).read())
-        docList.append(wordList)
-        fullText.extend(wordList)
-        classList.append(1)
-        wordList = textParse(open('email/ham/%d.txt' % i).read())
+    fileNames = ['email/%s/%d.txt' % (kind, i) for i in range(1,26) for kind in ('spam', 'ham')]
+    for fileName, wordList in tokenizeFiles(fileNames):
         docList.append(wordList)
         fullText.extend(wordList)
-        classList.append(0)
-    vocabList = createVocabList(docList)#create vocabulary
+        classList.append(1 if '/spam/' in fileName else 0)
+    vocab = Vocabulary(createVocabList(docList))#create vocabulary
+    docMat = vocab.transform(docList)               #sparse bag of words, one row per doc
     trainingSet = range(50); testSet=[]           #create test set
     for i in range(10):
         randIndex = int(random.uniform(0,len(trainingSet)))
         testSet.append(trainingSet[randIndex])
         del(trainingSet[randIndex])  
-    trainMat=[]; trainClasses = []
-    for docIndex in trainingSet:#train the classifier (get probs) trainNB0
-        trainMat.append(bagOfWords2VecMN(vocabList, docList[docIndex]))
-        trainClasses.append(classList[docIndex])
-    p0V,p1V,pSpam = trainNB0(array(trainMat),array(trainClasses))
+    classes,logProb,logPrior = trainNBSparse(docMat[trainingSet],array(classList)[trainingSet])
+    predicted = classify_batch(docMat[testSet],classes,logProb,logPrior)
     errorCount = 0
-    for docIndex in testSet:        #classify the remaining items
-        wordVector = bagOfWords2VecMN(vocabList, docList[docIndex])
-        if classifyNB(array(wordVector),p0V,p1V,pSpam) != classList[docIndex]:
+    for docIndex,label in zip(testSet,predicted):        #report the misclassified items
+        if label != classList[docIndex]:
             errorCount += 1
             print "classification error",docList[docIndex]
     print 'the error rate is: ',float(errorCount)/len(testSet)
     #return vocabList,fullText
 
-def calcMostFreq(vocabList,fullText):
-    import operator
-    freqDict = {}
-    for token in vocabList:
-        freqDict[token]=fullText.count(token)
-    sortedFreq = sorted(freqDict.iteritems(), key=operator.itemgetter(1), reverse=True) 
-    return sortedFreq[:30]       
+def calcMostFreq(vocabList,fullText,topN=30):
+    from collections import Counter
+    import heapq, operator
+    freqDict = Counter(fullText)        #one pass over the corpus
+    return heapq.nlargest(topN, ((token, freqDict[token]) for token in vocabList), key=operator.itemgetter(1))
 
 def localWords(feed1,feed0):
     import feedparser
@@ -133,24 +281,18 @@ def localWords(feed1,feed0):
         fullText.extend(wordList)
         classList.append(0)
     vocabList = createVocabList(docList)#create vocabulary
-    top30Words = calcMostFreq(vocabList,fullText)   #remove top 30 words
-    for pairW in top30Words:
-        if pairW[0] in vocabList: vocabList.remove(pairW[0])
+    top30Words = set(pairW[0] for pairW in calcMostFreq(vocabList,fullText))   #remove top 30 words
+    vocabList = [word for word in vocabList if word not in top30Words]
+    docMat = Vocabulary(vocabList).transform(docList)
     trainingSet = range(2*minLen); testSet=[]           #create test set
     for i in range(20):
         randIndex = int(random.uniform(0,len(trainingSet)))
         testSet.append(trainingSet[randIndex])
         del(trainingSet[randIndex])  
-    trainMat=[]; trainClasses = []
-    for docIndex in trainingSet:#train the classifier (get probs) trainNB0
-        trainMat.append(bagOfWords2VecMN(vocabList, docList[docIndex]))
-        trainClasses.append(classList[docIndex])
-    p0V,p1V,pSpam = trainNB0(array(trainMat),array(trainClasses))
-    errorCount = 0
-    for docIndex in testSet:        #classify the remaining items
-        wordVector = bagOfWords2VecMN(vocabList, docList[docIndex])
-        if classifyNB(array(wordVector),p0V,p1V,pSpam) != classList[docIndex]:
-            errorCount += 1
+    classes,logProb,logPrior = trainNBSparse(docMat[trainingSet],array(classList)[trainingSet])
+    p0V,p1V = logProb           #classes are sorted: 0 then 1
+    predicted = classify_batch(docMat[testSet],classes,logProb,logPrior)
+    errorCount = sum(predicted != array(classList)[testSet])
     print 'the error rate is: ',float(errorCount)/len(testSet)
     return vocabList,p0V,p1V
 
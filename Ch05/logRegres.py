@@ -4,18 +4,36 @@ Logistic Regression Working Module
 @author: Peter
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
 
 def loadDataSet():
-    dataMat = []; labelMat = []
-    fr = open('testSet.txt')
-    for line in fr.readlines():
-        lineArr = line.strip().split()
-        dataMat.append([1.0, float(lineArr[0]), float(lineArr[1])])
-        labelMat.append(int(lineArr[2]))
+    dataArr, labelMat = loadTabDelimited('testSet.txt', labelCol=2, delim=None, labelDtype=int)
+    dataMat = hstack((ones((dataArr.shape[0], 1)), dataArr))    #prepend the constant 1.0 feature
     return dataMat,labelMat
 
-def sigmoid(inX):
-    return 1.0/(1+exp(-inX))
+def sigmoid(inX, out=None):
+    """
+    1/(1+exp(-x)) computed in place in out (allocated if None, keeps matrix input a matrix)
+    exp(-x) overflows to inf for very negative x, which gives the exact limit 0, so the
+    overflow warning is silenced instead of clipping x
+    """
+    x = asanyarray(inX)
+    if out is None: out = empty_like(x, dtype=float)
+    with errstate(over='ignore'):
+        negative(x, out=out); exp(out, out=out)
+    out += 1.0
+    reciprocal(out, out=out)
+    if out.ndim == 0: return out[()]
+    return out
+
+def logSigmoid(inX, out=None):     #log(sigmoid(x)) = -log(1+exp(-x)) without overflow
+    x = asanyarray(inX)
+    if out is None: out = empty_like(x, dtype=float)
+    negative(x, out=out); logaddexp(0, out, out=out); negative(out, out=out)
+    if out.ndim == 0: return out[()]
+    return out
 
 def gradAscent(dataMatIn, classLabels):
     dataMatrix = mat(dataMatIn)             #convert to NumPy matrix
@@ -30,6 +48,84 @@ def gradAscent(dataMatIn, classLabels):
         weights = weights + alpha * dataMatrix.transpose()* error #matrix mult
     return weights
 
+def logLikelihood(weights, dataMatrix, labels, lam=0.0):
+    """
+    log likelihood of the labels minus lam/2*|weights|^2, and its gradient
+    """
+    z = dot(dataMatrix, weights)
+    value = dot(labels, z) - logaddexp(0, z).sum() - 0.5*lam*dot(weights, weights)
+    grad = dot(dataMatrix.T, labels - sigmoid(z)) - lam*weights
+    return value, grad
+
+def newtonLogRegres(dataMatIn, classLabels, maxIter=50, tol=1e-6, lam=0.0):
+    """
+    Newton's method (IRLS), for a modest number of features: every step solves an n x n system
+    stops when the gradient norm falls below tol times its value at the start (at least 1),
+    or when a step no longer improves the likelihood; on separable data use lam > 0, otherwise
+    the weights grow until maxIter
+    returns weights (1-D, usable by classifyVector and plotBestFit) and the number of iterations
+    """
+    dataMatrix = asarray(dataMatIn, dtype=float)
+    labels = asarray(classLabels, dtype=float).ravel()
+    m,n = shape(dataMatrix)
+    weights = zeros(n)
+    value, grad = logLikelihood(weights, dataMatrix, labels, lam)
+    gradNorm0 = max(1.0, linalg.norm(grad))
+    for k in range(maxIter):
+        if linalg.norm(grad) < tol*gradNorm0: return weights, k
+        p = sigmoid(dot(dataMatrix, weights))
+        hessian = dot(dataMatrix.T * (p*(1.0-p)), dataMatrix) + lam*eye(n)     #X^T W X
+        try: step = linalg.solve(hessian, grad)
+        except linalg.LinAlgError: step = linalg.lstsq(hessian, grad, rcond=None)[0]
+        t = 1.0
+        while True:             #halve the step until the likelihood goes up
+            newWeights = weights + t*step
+            newValue, newGrad = logLikelihood(newWeights, dataMatrix, labels, lam)
+            if newValue >= value: break
+            t *= 0.5
+            if t < 1e-10: return weights, k
+        weights, value, grad = newWeights, newValue, newGrad
+    return weights, maxIter
+
+def lbfgsLogRegres(dataMatIn, classLabels, maxIter=500, tol=1e-6, lam=0.0, memory=10):
+    """
+    limited memory BFGS, for wide data: only the last memory steps are kept, no n x n matrix
+    same stopping rule and return values as newtonLogRegres
+    """
+    dataMatrix = asarray(dataMatIn, dtype=float)
+    labels = asarray(classLabels, dtype=float).ravel()
+    m,n = shape(dataMatrix)
+    weights = zeros(n)
+    value, grad = logLikelihood(weights, dataMatrix, labels, lam)
+    gradNorm0 = max(1.0, linalg.norm(grad))
+    #diagonal of X^T W X at w=0 scales the initial inverse Hessian, unscaled columns would stall
+    diagH = 1.0 / maximum(0.25*(dataMatrix**2).sum(axis=0) + lam, 1e-12)
+    sList = []; yList = []
+    for k in range(maxIter):
+        if linalg.norm(grad) < tol*gradNorm0: return weights, k
+        q = grad.copy(); alphas = []                #two-loop recursion, ascent direction
+        for s, y in reversed(zip(sList, yList)):
+            a = dot(s, q) / dot(y, s)
+            q -= a*y; alphas.append(a)
+        q *= diagH
+        if sList: q *= dot(sList[-1], yList[-1]) / dot(yList[-1], diagH*yList[-1])
+        for (s, y), a in zip(zip(sList, yList), reversed(alphas)):
+            q += (a - dot(y, q) / dot(y, s)) * s
+        if dot(q, grad) <= 0: q = diagH*grad; sList = []; yList = []     #not an ascent direction, restart
+        t = 1.0
+        while True:             #backtracking until the Armijo condition holds
+            newWeights = weights + t*q
+            newValue, newGrad = logLikelihood(newWeights, dataMatrix, labels, lam)
+            if newValue >= value + 1e-4*t*dot(q, grad): break
+            t *= 0.5
+            if t < 1e-10: return weights, k     #no progress left at double precision
+        s = newWeights - weights; y = grad - newGrad       #curvature of the negative likelihood
+        if dot(s, y) > 1e-12:
+            sList.append(s); yList.append(y)
+            if len(sList) > memory: sList.pop(0); yList.pop(0)
+        weights, value, grad = newWeights, newValue, newGrad
+    return weights, maxIter
+
 def plotBestFit(weights):
     import matplotlib.pyplot as plt
     dataMat,labelMat=loadDataSet()
@@ -63,17 +159,28 @@ def stocGradAscent0(dataMatrix, classLabels):
     return weights
 
 def stocGradAscent1(dataMatrix, classLabels, numIter=150):
+    return miniBatchGradAscent(dataMatrix, classLabels, numIter, batchSize=1)
+
+def miniBatchGradAscent(dataMatrix, classLabels, numIter=150, batchSize=1):
+    """
+    each epoch visits the rows in a random permutation, batchSize rows per update
+    every row keeps its own alpha = 4/(1.0+j+i)+0.0001 from the stocGradAscent1 schedule,
+    so batchSize=1 is plain sequential SGD and larger batches only reuse the weights
+    for the rows of one batch
+    """
+    dataMatrix = asarray(dataMatrix, dtype=float)
+    labels = asarray(classLabels, dtype=float).ravel()
     m,n = shape(dataMatrix)
     weights = ones(n)   #initialize to all ones
+    steps = arange(m)
     for j in range(numIter):
-        dataIndex = range(m)
-        for i in range(m):
-            alpha = 4/(1.0+j+i)+0.0001    #apha decreases with iteration, does not 
-            randIndex = int(random.uniform(0,len(dataIndex)))#go to 0 because of the constant
-            h = sigmoid(sum(dataMatrix[randIndex]*weights))
-            error = classLabels[randIndex] - h
-            weights = weights + alpha * error * dataMatrix[randIndex]
-            del(dataIndex[randIndex])
+        order = random.permutation(m)           #sampling without replacement, no list deletes
+        alphas = 4/(1.0+j+steps)+0.0001         #alpha decreases with iteration, does not go to 0
+        for start in range(0, m, batchSize):
+            rows = order[start:start+batchSize]
+            batch = dataMatrix[rows]
+            error = labels[rows] - sigmoid(dot(batch, weights))
+            weights = weights + dot(alphas[start:start+batchSize] * error, batch)
     return weights
 
 def classifyVector(inX, weights):
@@ -81,33 +188,21 @@ def classifyVector(inX, weights):
     if prob > 0.5: return 1.0
     else: return 0.0
 
-def colicTest():
-    frTrain = open('horseColicTraining.txt'); frTest = open('../horseColicTest.txt')
-    trainingSet = []; trainingLabels = []
-    for line in frTrain.readlines():
-        currLine = line.strip().split('\t')
-        lineArr =[]
-        for i in range(21):
-            lineArr.append(float(currLine[i]))
-        trainingSet.append(lineArr)
-        trainingLabels.append(float(currLine[21]))
-    trainWeights = stocGradAscent1(array(trainingSet), trainingLabels, 1000)
-    errorCount = 0; numTestVec = 0.0
-    for line in frTest.readlines():
-        numTestVec += 1.0
-        currLine = line.strip().split('\t')
-        lineArr =[]
-        for i in range(21):
-            lineArr.append(float(currLine[i]))
-        if int(classifyVector(array(lineArr), trainWeights))!= int(currLine[21]):
-            errorCount += 1
-    errorRate = (float(errorCount)/numTestVec)
+def classify_batch(testMatrix, weights):    #classifyVector for every row at once
+    prob = sigmoid(dot(asarray(testMatrix, dtype=float), asarray(weights, dtype=float).ravel()))
+    return where(prob > 0.5, 1.0, 0.0)
+
+def colicTest(batchSize=16):
+    trainingSet, trainingLabels = loadTabDelimited('horseColicTraining.txt', labelCol=21)
+    testSet, testLabels = loadTabDelimited('horseColicTest.txt', labelCol=21)
+    trainWeights = miniBatchGradAscent(trainingSet, trainingLabels, 1000, batchSize)
+    errorRate = mean(classify_batch(testSet, trainWeights) != testLabels)
     print "the error rate of this test is: %f" % errorRate
     return errorRate
 
-def multiTest():
+def multiTest(batchSize=16):
     numTests = 10; errorSum=0.0
     for k in range(numTests):
-        errorSum += colicTest()
+        errorSum += colicTest(batchSize)
     print "after %d iterations the average error rate is: %f" % (numTests, errorSum/float(numTests))
         
\ No newline at end of file
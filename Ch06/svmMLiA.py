@@ -4,16 +4,16 @@ Chapter 5 source file for Machine Learing in Action
 @author: Peter
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
+from common.digits import loadPackedDigits
+from common.npzFile import npzName
 from time import sleep
+from collections import OrderedDict
 
 def loadDataSet(fileName):
-    dataMat = []; labelMat = []
-    fr = open(fileName)
-    for line in fr.readlines():
-        lineArr = line.strip().split('\t')
-        dataMat.append([float(lineArr[0]), float(lineArr[1])])
-        labelMat.append(float(lineArr[2]))
-    return dataMat,labelMat
+    return loadTabDelimited(fileName, usecols=[0, 1], labelCol=2)
 
 def selectJrand(i,m):
     j=i #we want to select any J not equal to i
@@ -69,21 +69,178 @@ def smoSimple(dataMatIn, classLabels, C, toler, maxIter):
         print "iteration number: %d" % iter
     return b,alphas
 
-def kernelTrans(X, A, kTup): #calc the kernel or transform data to a higher dimensional space
-    m,n = shape(X)
-    K = mat(zeros((m,1)))
-    if kTup[0]=='lin': K = X * A.T   #linear kernel
-    elif kTup[0]=='rbf':
-        for j in range(m):
-            deltaRow = X[j,:] - A
-            K[j] = deltaRow*deltaRow.T
-        K = exp(K/(-1*kTup[1]**2)) #divide in NumPy is element-wise not matrix like Matlab
-    else: raise NameError('Houston We Have a Problem -- \
+def kernelMatrix(X, A, kTup, XSqNorms=None, maxBlockBytes=64*2**20):
+    """
+    kernel values of every row of X against every row of A as an m x k ndarray
+    rbf uses |x-a|^2 = |x|^2 + |a|^2 - 2x.a, one matrix product per block of X rows;
+    the blocks bound the temporaries to about maxBlockBytes
+    XSqNorms: precomputed squared row norms of X (rbf only)
+    """
+    if kTup[0] not in ('lin', 'rbf'): raise NameError('Houston We Have a Problem -- \
     That Kernel is not recognized')
+    X = asarray(X, dtype=float); A = asarray(A, dtype=float)
+    if A.ndim == 1: A = A.reshape(1, -1)
+    m = X.shape[0]; k = A.shape[0]
+    K = empty((m, k))
+    if kTup[0] == 'rbf':
+        if XSqNorms is None: XSqNorms = (X**2).sum(axis=1)
+        ASqNorms = (A**2).sum(axis=1)
+        gamma = -1.0/kTup[1]**2
+    blockRows = max(1, maxBlockBytes // (8*max(k, 1)))
+    for start in range(0, m, blockRows):
+        block = K[start:start+blockRows]
+        dot(X[start:start+blockRows], A.T, out=block)
+        if kTup[0] == 'rbf':
+            block *= -2.0
+            block += XSqNorms[start:start+blockRows, newaxis]; block += ASqNorms
+            maximum(block, 0.0, out=block)      #rounding can leave tiny negative distances
+            block *= gamma
+            exp(block, out=block)
     return K
 
+def kernelTrans(X, A, kTup): #calc the kernel or transform data to a higher dimensional space
+    return mat(kernelMatrix(X, A, kTup))
+
+def kernelDot(X, A, coef, kTup, XSqNorms=None, maxBlockBytes=64*2**20):
+    """
+    kernelMatrix(X, A, kTup).dot(coef) without holding the whole m x k matrix,
+    one block of X rows at a time; coef may be a k x p matrix, one column per model
+    """
+    X = asarray(X, dtype=float); A = asarray(A, dtype=float)
+    if A.ndim == 1: A = A.reshape(1, -1)
+    if XSqNorms is None: XSqNorms = (X**2).sum(axis=1)
+    result = zeros((X.shape[0],) + shape(coef)[1:])
+    blockRows = max(1, maxBlockBytes // (8*max(A.shape[0], 1)))
+    for start in range(0, X.shape[0], blockRows):
+        stop = start + blockRows
+        result[start:stop] = kernelMatrix(X[start:stop], A, kTup, XSqNorms[start:stop], maxBlockBytes).dot(coef)
+    return result
+
+class KernelCache:
+    """
+    rows of the kernel matrix computed on demand and kept in LRU order within maxBytes,
+    like the LIBSVM kernel cache; the kernel is symmetric so row i is also column i
+    after setActive(cols) new rows are only computed for the columns in cols, the others are nan
+    gram: optional precomputed m x m kernel matrix (e.g. a memmap shared between processes),
+    rows are then copied out of it instead of computed
+    """
+    def __init__(self, X, kTup, maxBytes=100*2**20, gram=None):
+        self.X = asarray(X, dtype=float)
+        self.kTup = kTup
+        self.gram = gram
+        self.m = self.X.shape[0]
+        self.sqNorms = (self.X**2).sum(axis=1)
+        if kTup[0] == 'rbf': self.diag = ones(self.m)
+        elif kTup[0] == 'lin': self.diag = self.sqNorms
+        else: raise NameError('Houston We Have a Problem -- That Kernel is not recognized')
+        self.maxRows = max(2, int(maxBytes // (8*self.m)))
+        self.rows = OrderedDict()   #i -> (row, computed for all columns)
+        self.cols = None
+        self.hits = 0; self.misses = 0
+
+    def setActive(self, cols):
+        """
+        cols: sorted column indices, each call a subset of the previous one; None for all columns
+        rows computed for a larger set stay valid, partial rows are dropped when going back to all
+        """
+        self.cols = cols
+        if cols is None:
+            for i in [i for i, (r, full) in self.rows.items() if not full]: del self.rows[i]
+        else:
+            self.activeX = self.X[cols]; self.activeSqNorms = self.sqNorms[cols]
+
+    def row(self, i):
+        entry = self.rows.pop(i, None)
+        if entry is None:
+            self.misses += 1
+            if self.gram is not None:
+                r = array(self.gram[i], dtype=float)    #always the full row
+            elif self.cols is None:
+                r = kernelMatrix(self.X, self.X[i], self.kTup, self.sqNorms)[:, 0]
+            else:
+                r = empty(self.m); r.fill(nan)
+                r[self.cols] = kernelMatrix(self.activeX, self.X[i], self.kTup, self.activeSqNorms)[:, 0]
+            r[i] = self.diag[i]
+            entry = (r, self.cols is None or self.gram is not None)
+            if len(self.rows) >= self.maxRows: self.rows.popitem(last=False)    #evict least recently used
+        else: self.hits += 1
+        self.rows[i] = entry
+        return entry[0]
+
+    def __getitem__(self, ij):    #single entry, taken from a cached row when there is one
+        i, j = ij
+        if i == j: return self.diag[i]
+        if i in self.rows: return self.rows[i][0][j]
+        if j in self.rows: return self.rows[j][0][i]
+        return self.row(i)[j]
+
+class SVModel:
+    """
+    trained SVM: only the support vectors, their dual coefficients alpha_i*y_i, b and the kernel
+    """
+    def __init__(self, supportVectors, dualCoef, b, kTup):
+        self.supportVectors = ascontiguousarray(supportVectors, dtype=float)
+        self.dualCoef = ascontiguousarray(dualCoef, dtype=float).ravel()
+        self.b = float(b)
+        self.kTup = (kTup[0], float(kTup[1]))
+
+    def decision_function(self, X):    #f(x) for every row of X, one blocked kernel product
+        return kernelDot(X, self.supportVectors, self.dualCoef, self.kTup) + self.b
+
+    def predict(self, X):
+        return sign(self.decision_function(X))
+
+    def save(self, fileName):
+        savez(fileName, supportVectors=self.supportVectors, dualCoef=self.dualCoef, b=array(self.b),
+              kernel=array(self.kTup[0]), kernelParam=array(self.kTup[1]))
+
+def loadSVModel(fileName):    #reads SVModel.save(), no pickles
+    state = load(npzName(fileName), allow_pickle=False)
+    return SVModel(state['supportVectors'], state['dualCoef'], float(state['b']),
+                   (str(state['kernel']), float(state['kernelParam'])))
+
+class MultiSVModel:
+    """
+    one-vs-rest or one-vs-one SVMs over one shared set of support vectors:
+    column k of dualCoef and b[k] belong to binary problem k, so every decision value
+    comes out of a single blocked kernel product
+    pairs: None for one-vs-rest (problem k is classes[k] against the rest),
+    else a p x 2 array, problem k is classes[pairs[k,0]] (+1) against classes[pairs[k,1]] (-1)
+    """
+    def __init__(self, supportVectors, dualCoef, b, kTup, classes, pairs=None):
+        self.supportVectors = ascontiguousarray(supportVectors, dtype=float)
+        self.dualCoef = ascontiguousarray(dualCoef, dtype=float)
+        self.b = asarray(b, dtype=float).ravel()
+        self.kTup = (kTup[0], float(kTup[1]))
+        self.classes = asarray(classes)
+        self.pairs = None if pairs is None else asarray(pairs, dtype=int).reshape(-1, 2)
+
+    def decision_function(self, X):    #m x p decision values, one column per binary problem
+        return kernelDot(X, self.supportVectors, self.dualCoef, self.kTup) + self.b
+
+    def predict(self, X):
+        D = self.decision_function(X)
+        if self.pairs is None: return self.classes[D.argmax(axis=1)]
+        m = D.shape[0]; numClasses = len(self.classes)
+        winners = where(D > 0, self.pairs[:, 0], self.pairs[:, 1])    #m x p class indices
+        votes = bincount((arange(m)[:, newaxis]*numClasses + winners).ravel(),
+                         minlength=m*numClasses).reshape(m, numClasses)
+        return self.classes[votes.argmax(axis=1)]    #ties go to the lower class index, as in LIBSVM
+
+    def save(self, fileName):
+        savez(fileName, supportVectors=self.supportVectors, dualCoef=self.dualCoef, b=self.b,
+              kernel=array(self.kTup[0]), kernelParam=array(self.kTup[1]), classes=self.classes,
+              pairs=zeros((0, 2), dtype=int) if self.pairs is None else self.pairs)
+
+def loadMultiSVModel(fileName):    #reads MultiSVModel.save(), no pickles
+    state = load(npzName(fileName), allow_pickle=False)
+    pairs = state['pairs']
+    return MultiSVModel(state['supportVectors'], state['dualCoef'], state['b'],
+                        (str(state['kernel']), float(state['kernelParam'])), state['classes'],
+                        pairs if len(pairs) > 0 else None)
+
 class optStruct:
-    def __init__(self,dataMatIn, classLabels, C, toler, kTup):  # Initialize the structure with the parameters 
+    def __init__(self,dataMatIn, classLabels, C, toler, kTup, cacheBytes=100*2**20, selection='platt', gram=None):  # Initialize the structure with the parameters 
         self.X = dataMatIn
         self.labelMat = classLabels
         self.C = C
@@ -92,32 +249,116 @@ class optStruct:
         self.alphas = mat(zeros((self.m,1)))
         self.b = 0
         self.eCache = mat(zeros((self.m,2))) #first column is valid flag
-        self.K = mat(zeros((self.m,self.m)))
-        for i in range(self.m):
-            self.K[:,i] = kernelTrans(self.X, self.X[i,:], kTup)
+        self.K = KernelCache(self.X, kTup, cacheBytes, gram)     #rows computed on demand instead of the full m x m matrix
+        self.y = asarray(classLabels, dtype=float).ravel()
+        self.F = zeros(self.m)      #sum_i alpha_i*y_i*K(i,k) for every k, updated whenever an alpha moves
+        self.selection = selection  #'platt': max |Ei-Ej| over the eCache, 'wss2': max violator i, second order j
+        self.active = arange(self.m)    #samples still optimized, see shrink()
+        self.activeMask = ones(self.m, dtype=bool)
         
 def calcEk(oS, k):
-    fXk = float(multiply(oS.alphas,oS.labelMat).T*oS.K[:,k] + oS.b)
-    Ek = fXk - float(oS.labelMat[k])
-    return Ek
+    return float(oS.F[k] + oS.b) - oS.y[k]
+
+def updateF(oS, k, deltaAlpha):    #O(m) instead of recomputing f(x) for every sample
+    if deltaAlpha == 0: return
+    if len(oS.active) == oS.m: oS.F += (deltaAlpha*oS.y[k]) * oS.K.row(k)
+    else: oS.F[oS.active] += (deltaAlpha*oS.y[k]) * oS.K.row(k)[oS.active]     #shrunk samples are fixed up in unshrink()
+
+def randomPartner(i, oS):
+    if len(oS.active) == oS.m: return selectJrand(i, oS.m)
+    return oS.active[selectJrand(searchsorted(oS.active, i), len(oS.active))]
+
+def shrink(oS):
+    """
+    drop bound alphas from the active set when their KKT condition holds by more than the
+    largest current violation (alpha=0 with y*E > Gmax, alpha=C with y*E < -Gmax), as LIBSVM does;
+    early on Gmax is large and little is dropped, near convergence it approaches tol
+    """
+    act = oS.active
+    a = oS.alphas.A1[act]
+    yE = oS.y[act]*(oS.F[act] + float(oS.b) - oS.y[act])
+    lower = a <= 0; upper = a >= oS.C
+    Gmax = max(oS.tol, where(upper, -inf, -yE).max(), where(lower, -inf, yE).max())
+    keep = ~((lower & (yE > Gmax)) | (upper & (yE < -Gmax)))
+    if keep.all() or keep.sum() < 2: return
+    oS.active = act[keep]
+    oS.activeMask[act[~keep]] = False
+    oS.K.setActive(oS.active)
+
+def unshrink(oS):    #rebuild F for the dropped samples and make every sample active again
+    inactive = nonzero(~oS.activeMask)[0]
+    sv = nonzero(oS.alphas.A1 > 0)[0]
+    K = oS.K
+    if len(sv) == 0: oS.F[inactive] = 0.0
+    else: oS.F[inactive] = kernelDot(K.X[inactive], K.X[sv], oS.alphas.A1[sv]*oS.y[sv], K.kTup, K.sqNorms[inactive])
+    oS.active = arange(oS.m); oS.activeMask[:] = True
+    K.setActive(None)
         
 def selectJ(i, oS, Ei):         #this is the second choice -heurstic, and calcs Ej
-    maxK = -1; maxDeltaE = 0; Ej = 0
     oS.eCache[i] = [1,Ei]  #set valid #choose the alpha that gives the maximum delta E
-    validEcacheList = nonzero(oS.eCache[:,0].A)[0]
+    validEcacheList = nonzero(oS.eCache[:,0].A1 * oS.activeMask)[0]
     if (len(validEcacheList)) > 1:
-        for k in validEcacheList:   #loop through valid Ecache values and find the one that maximizes delta E
-            if k == i: continue #don't calc for i, waste of time
-            Ek = calcEk(oS, k)
-            deltaE = abs(Ei - Ek)
-            if (deltaE > maxDeltaE):
-                maxK = k; maxDeltaE = deltaE; Ej = Ek
-        return maxK, Ej
+        Ek = oS.F[validEcacheList] + float(oS.b) - oS.y[validEcacheList]
+        deltaE = abs(Ei - Ek)
+        deltaE[validEcacheList == i] = -1   #don't pick i itself
+        best = deltaE.argmax()              #first maximum, like the loop it replaces
+        if deltaE[best] > 0: return validEcacheList[best], Ek[best]
+        return -1, 0
     else:   #in this case (first time around) we don't have any valid eCache values
-        j = selectJrand(i, oS.m)
+        j = randomPartner(i, oS)
         Ej = calcEk(oS, j)
     return j, Ej
 
+def selectIWSS2(oS):
+    """
+    first half of the WSS2 working set (Fan, Chen and Lin 2005, as in LIBSVM): i is the sample of
+    I_up = {y=1,alpha<C} u {y=-1,alpha>0} with the smallest error, the maximal KKT violator;
+    returns -1 when max E over I_low = {y=1,alpha>0} u {y=-1,alpha<C} is within 2*tol of it,
+    i.e. the active samples are optimal (b cancels, so the errors leave it out)
+    """
+    act = oS.active
+    a = oS.alphas.A1[act]; y = oS.y[act]; E = oS.F[act] - y
+    up = ((y > 0) & (a < oS.C)) | ((y < 0) & (a > 0))
+    low = ((y > 0) & (a > 0)) | ((y < 0) & (a < oS.C))
+    if not up.any() or not low.any(): return -1
+    Eup = where(up, E, inf)
+    best = Eup.argmin()
+    if where(low, E, -inf).max() - Eup[best] <= 2*oS.tol: return -1
+    return act[best]
+
+def setOptimalB(oS):
+    """
+    b midway between the smallest error over I_up and the largest over I_low (see selectIWSS2),
+    so every sample meets its KKT condition within tol once the pair gap is below 2*tol
+    """
+    a = oS.alphas.A1; y = oS.y; E = oS.F - y
+    up = ((y > 0) & (a < oS.C)) | ((y < 0) & (a > 0))
+    low = ((y > 0) & (a > 0)) | ((y < 0) & (a < oS.C))
+    if up.any() and low.any(): oS.b = -0.5*(E[up].min() + E[low].max())
+
+def selectJWSS2(i, oS, Ei):
+    """
+    second order choice of j: the pair (i,j) whose clipped SMO step raises the dual objective most,
+    gain = eta*(d*step - d*d/2) with eta = Kii+Kjj-2Kij, step the unclipped change of alpha_j, d the clipped one
+    every j is a candidate since the error vector is exact for all samples
+    """
+    act = oS.active
+    a = oS.alphas.A1[act]; y = oS.y[act]; C = oS.C; ai = oS.alphas.A1[i]
+    E = oS.F[act] + float(oS.b) - y
+    eta = oS.K.diag[i] + oS.K.diag[act] - 2.0*oS.K.row(i)[act]
+    valid = eta > 1e-12
+    step = y*(Ei - E) / where(valid, eta, 1.0)
+    same = y == oS.y[i]
+    L = where(same, maximum(0, a + ai - C), maximum(0, a - ai))
+    H = where(same, minimum(C, a + ai), minimum(C, C + a - ai))
+    d = minimum(maximum(a + step, L), H) - a
+    gain = where(valid, eta*(d*step - 0.5*d*d), -1.0)
+    gain[act == i] = -1.0
+    best = gain.argmax()
+    if gain[best] > 0: return act[best], float(E[best])
+    j = randomPartner(i, oS)    #no pair makes progress, fall back to a random partner
+    return j, calcEk(oS, j)
+
 def updateEk(oS, k):#after any alpha has changed update the new value in the cache
     Ek = calcEk(oS, k)
     oS.eCache[k] = [1,Ek]
@@ -126,50 +367,102 @@ def innerL(i, oS):
     Ei = calcEk(oS, i)
     if ((oS.labelMat[i]*Ei < -oS.tol) and (oS.alphas[i] < oS.C)) or ((oS.labelMat[i]*Ei > oS.tol) and (oS.alphas[i] > 0)):
         j,Ej = selectJ(i, oS, Ei) #this has been changed from selectJrand
-        alphaIold = oS.alphas[i].copy(); alphaJold = oS.alphas[j].copy();
-        if (oS.labelMat[i] != oS.labelMat[j]):
-            L = max(0, oS.alphas[j] - oS.alphas[i])
-            H = min(oS.C, oS.C + oS.alphas[j] - oS.alphas[i])
-        else:
-            L = max(0, oS.alphas[j] + oS.alphas[i] - oS.C)
-            H = min(oS.C, oS.alphas[j] + oS.alphas[i])
-        if L==H: print "L==H"; return 0
-        eta = 2.0 * oS.K[i,j] - oS.K[i,i] - oS.K[j,j] #changed for kernel
-        if eta >= 0: print "eta>=0"; return 0
-        oS.alphas[j] -= oS.labelMat[j]*(Ei - Ej)/eta
-        oS.alphas[j] = clipAlpha(oS.alphas[j],H,L)
-        updateEk(oS, j) #added this for the Ecache
-        if (abs(oS.alphas[j] - alphaJold) < 0.00001): print "j not moving enough"; return 0
-        oS.alphas[i] += oS.labelMat[j]*oS.labelMat[i]*(alphaJold - oS.alphas[j])#update i by the same amount as j
-        updateEk(oS, i) #added this for the Ecache                    #the update is in the oppostie direction
-        b1 = oS.b - Ei- oS.labelMat[i]*(oS.alphas[i]-alphaIold)*oS.K[i,i] - oS.labelMat[j]*(oS.alphas[j]-alphaJold)*oS.K[i,j]
-        b2 = oS.b - Ej- oS.labelMat[i]*(oS.alphas[i]-alphaIold)*oS.K[i,j]- oS.labelMat[j]*(oS.alphas[j]-alphaJold)*oS.K[j,j]
-        if (0 < oS.alphas[i]) and (oS.C > oS.alphas[i]): oS.b = b1
-        elif (0 < oS.alphas[j]) and (oS.C > oS.alphas[j]): oS.b = b2
-        else: oS.b = (b1 + b2)/2.0
-        return 1
+        return takeStep(i, j, Ei, Ej, oS)
     else: return 0
 
-def smoP(dataMatIn, classLabels, C, toler, maxIter,kTup=('lin', 0)):    #full Platt SMO
-    oS = optStruct(mat(dataMatIn),mat(classLabels).transpose(),C,toler, kTup)
+def takeStep(i, j, Ei, Ej, oS, minMove=0.00001):    #optimize the pair i,j; returns 1 if alpha_j moved by minMove
+    alphaIold = oS.alphas[i].copy(); alphaJold = oS.alphas[j].copy();
+    if (oS.labelMat[i] != oS.labelMat[j]):
+        L = max(0, oS.alphas[j] - oS.alphas[i])
+        H = min(oS.C, oS.C + oS.alphas[j] - oS.alphas[i])
+    else:
+        L = max(0, oS.alphas[j] + oS.alphas[i] - oS.C)
+        H = min(oS.C, oS.alphas[j] + oS.alphas[i])
+    if L==H: print "L==H"; return 0
+    eta = 2.0 * oS.K[i,j] - oS.K[i,i] - oS.K[j,j] #changed for kernel
+    if eta >= 0: print "eta>=0"; return 0
+    oS.alphas[j] -= oS.labelMat[j]*(Ei - Ej)/eta
+    oS.alphas[j] = clipAlpha(oS.alphas[j],H,L)
+    updateF(oS, j, float(oS.alphas[j] - alphaJold))
+    updateEk(oS, j) #added this for the Ecache
+    if (abs(oS.alphas[j] - alphaJold) < minMove) or (oS.alphas[j] == alphaJold): print "j not moving enough"; return 0
+    oS.alphas[i] += oS.labelMat[j]*oS.labelMat[i]*(alphaJold - oS.alphas[j])#update i by the same amount as j
+    updateF(oS, i, float(oS.alphas[i] - alphaIold))
+    updateEk(oS, i) #added this for the Ecache                    #the update is in the oppostie direction
+    b1 = oS.b - Ei- oS.labelMat[i]*(oS.alphas[i]-alphaIold)*oS.K[i,i] - oS.labelMat[j]*(oS.alphas[j]-alphaJold)*oS.K[i,j]
+    b2 = oS.b - Ej- oS.labelMat[i]*(oS.alphas[i]-alphaIold)*oS.K[i,j]- oS.labelMat[j]*(oS.alphas[j]-alphaJold)*oS.K[j,j]
+    if (0 < oS.alphas[i]) and (oS.C > oS.alphas[i]): oS.b = b1
+    elif (0 < oS.alphas[j]) and (oS.C > oS.alphas[j]): oS.b = b2
+    else: oS.b = (b1 + b2)/2.0
+    return 1
+
+def smoPlatt(oS, maxIter):    #the book's outer loop: full passes alternating with passes over the non-bound alphas
     iter = 0
     entireSet = True; alphaPairsChanged = 0
     while (iter < maxIter) and ((alphaPairsChanged > 0) or (entireSet)):
         alphaPairsChanged = 0
         if entireSet:   #go over all
-            for i in range(oS.m):        
-                alphaPairsChanged += innerL(i,oS)
-                print "fullSet, iter: %d i:%d, pairs changed %d" % (iter,i,alphaPairsChanged)
-            iter += 1
+            candidates = range(oS.m)
         else:#go over non-bound (railed) alphas
-            nonBoundIs = nonzero((oS.alphas.A > 0) * (oS.alphas.A < C))[0]
-            for i in nonBoundIs:
-                alphaPairsChanged += innerL(i,oS)
-                print "non-bound, iter: %d i:%d, pairs changed %d" % (iter,i,alphaPairsChanged)
-            iter += 1
+            candidates = nonzero((oS.alphas.A1 > 0) * (oS.alphas.A1 < oS.C))[0]
+        for i in candidates:
+            alphaPairsChanged += innerL(i,oS)
+            if entireSet: print "fullSet, iter: %d i:%d, pairs changed %d" % (iter,i,alphaPairsChanged)
+            else: print "non-bound, iter: %d i:%d, pairs changed %d" % (iter,i,alphaPairsChanged)
+        iter += 1
         if entireSet: entireSet = False #toggle entire set loop
         elif (alphaPairsChanged == 0): entireSet = True  
         print "iteration number: %d" % iter
+
+def smoWSS2(oS, maxIter, shrinking):
+    """
+    SMO with the WSS2 working set: every step optimizes the maximal violator i (selectIWSS2)
+    with the j of largest second order gain (selectJWSS2); maxIter counts blocks of m steps,
+    about one Platt pass each. Stops when the pair gap is below 2*tol on all samples or when
+    the chosen pair cannot move, then sets b from the optimality conditions
+    """
+    shrinkEvery = min(oS.m, 1000); untilShrink = shrinkEvery
+    step = 0
+    while step < maxIter*oS.m:
+        i = selectIWSS2(oS)
+        if i >= 0:
+            Ei = calcEk(oS, i)
+            oS.eCache[i] = [1,Ei]
+            j, Ej = selectJWSS2(i, oS, Ei)
+            moved = takeStep(i, j, Ei, Ej, oS, 0.0)    #every step counts, tiny ones included
+            step += 1
+            print "wss2, step: %d i:%d j:%d, moved %d" % (step,i,j,moved)
+        if i < 0 or not moved:
+            if len(oS.active) == oS.m: break
+            unshrink(oS)    #optimal on the active set, check all samples before stopping
+            shrinking = False; continue
+        if shrinking:
+            untilShrink -= 1
+            if untilShrink == 0: shrink(oS); untilShrink = shrinkEvery
+    if len(oS.active) < oS.m: unshrink(oS)
+    setOptimalB(oS)
+
+def smoP(dataMatIn, classLabels, C, toler, maxIter,kTup=('lin', 0), cacheBytes=100*2**20, selection='platt',
+         shrinking=False, returnModel=False, gram=None):    #full Platt SMO
+    """
+    returnModel: return an SVModel instead of b,alphas
+    gram: precomputed kernel matrix of dataMatIn, see KernelCache
+    shrinking: every min(m,1000) steps drop the bound alphas that are unlikely to move (see shrink);
+    once the active samples are optimal the errors of the dropped ones are rebuilt and the
+    optimization continues over all samples, with shrinking switched off from then on;
+    needs selection='wss2': the Platt heuristic only looks at the cached errors, which shrinking
+    takes away, and ends up slower and at a different solution
+    selection: 'platt' for the book's outer loop and max |Ei-Ej| choice of j,
+    'wss2' for maximal violator i and second order j, see smoWSS2
+    """
+    if selection not in ('platt', 'wss2'): raise ValueError('unknown selection %r' % (selection,))
+    if shrinking and selection != 'wss2': raise ValueError("shrinking needs selection='wss2'")
+    oS = optStruct(mat(dataMatIn),mat(classLabels).transpose(),C,toler, kTup, cacheBytes, selection, gram)
+    if selection == 'wss2': smoWSS2(oS, maxIter, shrinking)
+    else: smoPlatt(oS, maxIter)
+    if returnModel:
+        svInd = nonzero(oS.alphas.A1 > 0)[0]
+        return SVModel(oS.K.X[svInd], oS.alphas.A1[svInd]*oS.y[svInd], oS.b, kTup)
     return oS.b,oS.alphas
 
 def calcWs(alphas,dataArr,classLabels):
@@ -182,27 +475,14 @@ def calcWs(alphas,dataArr,classLabels):
 
 def testRbf(k1=1.3):
     dataArr,labelArr = loadDataSet('testSetRBF.txt')
-    b,alphas = smoP(dataArr, labelArr, 200, 0.0001, 10000, ('rbf', k1)) #C=200 important
-    datMat=mat(dataArr); labelMat = mat(labelArr).transpose()
-    svInd=nonzero(alphas.A>0)[0]
-    sVs=datMat[svInd] #get matrix of only support vectors
-    labelSV = labelMat[svInd];
-    print "there are %d Support Vectors" % shape(sVs)[0]
-    m,n = shape(datMat)
-    errorCount = 0
-    for i in range(m):
-        kernelEval = kernelTrans(sVs,datMat[i,:],('rbf', k1))
-        predict=kernelEval.T * multiply(labelSV,alphas[svInd]) + b
-        if sign(predict)!=sign(labelArr[i]): errorCount += 1
+    model = smoP(dataArr, labelArr, 200, 0.0001, 10000, ('rbf', k1), returnModel=True) #C=200 important
+    print "there are %d Support Vectors" % shape(model.supportVectors)[0]
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=sign(labelArr)))
     print "the training error rate is: %f" % (float(errorCount)/m)
     dataArr,labelArr = loadDataSet('testSetRBF2.txt')
-    errorCount = 0
-    datMat=mat(dataArr); labelMat = mat(labelArr).transpose()
-    m,n = shape(datMat)
-    for i in range(m):
-        kernelEval = kernelTrans(sVs,datMat[i,:],('rbf', k1))
-        predict=kernelEval.T * multiply(labelSV,alphas[svInd]) + b
-        if sign(predict)!=sign(labelArr[i]): errorCount += 1    
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=sign(labelArr)))
     print "the test error rate is: %f" % (float(errorCount)/m)    
     
 def img2vector(filename):
@@ -214,46 +494,134 @@ def img2vector(filename):
             returnVect[0,32*i+j] = int(lineStr[j])
     return returnVect
 
-def loadImages(dirName):
+def loadImages(dirName, binary=True):    #binary: labels 9 -> -1, others -> 1; else the digits themselves
     from os import listdir
     hwLabels = []
-    trainingFileList = listdir(dirName)           #load the training set
+    trainingFileList = sorted(listdir(dirName))           #load the training set, same order as loadPackedDigits
     m = len(trainingFileList)
     trainingMat = zeros((m,1024))
     for i in range(m):
         fileNameStr = trainingFileList[i]
         fileStr = fileNameStr.split('.')[0]     #take off .txt
         classNumStr = int(fileStr.split('_')[0])
-        if classNumStr == 9: hwLabels.append(-1)
+        if not binary: hwLabels.append(classNumStr)
+        elif classNumStr == 9: hwLabels.append(-1)
         else: hwLabels.append(1)
         trainingMat[i,:] = img2vector('%s/%s' % (dirName, fileNameStr))
     return trainingMat, hwLabels    
 
+def loadImagesPacked(prefix, binary=True):    #reads the files written by common.digits.packDigits() with a memmap
+    trainingMat, digitLabels = loadPackedDigits(prefix)
+    if not binary: return trainingMat, digitLabels
+    hwLabels = [-1 if digit == 9 else 1 for digit in digitLabels]
+    return trainingMat, hwLabels
+
 def testDigits(kTup=('rbf', 10)):
     dataArr,labelArr = loadImages('trainingDigits')
-    b,alphas = smoP(dataArr, labelArr, 200, 0.0001, 10000, kTup)
-    datMat=mat(dataArr); labelMat = mat(labelArr).transpose()
-    svInd=nonzero(alphas.A>0)[0]
-    sVs=datMat[svInd] 
-    labelSV = labelMat[svInd];
-    print "there are %d Support Vectors" % shape(sVs)[0]
-    m,n = shape(datMat)
-    errorCount = 0
-    for i in range(m):
-        kernelEval = kernelTrans(sVs,datMat[i,:],kTup)
-        predict=kernelEval.T * multiply(labelSV,alphas[svInd]) + b
-        if sign(predict)!=sign(labelArr[i]): errorCount += 1
+    model = smoP(dataArr, labelArr, 200, 0.0001, 10000, kTup, returnModel=True)
+    print "there are %d Support Vectors" % shape(model.supportVectors)[0]
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=sign(labelArr)))
     print "the training error rate is: %f" % (float(errorCount)/m)
     dataArr,labelArr = loadImages('testDigits')
-    errorCount = 0
-    datMat=mat(dataArr); labelMat = mat(labelArr).transpose()
-    m,n = shape(datMat)
-    for i in range(m):
-        kernelEval = kernelTrans(sVs,datMat[i,:],kTup)
-        predict=kernelEval.T * multiply(labelSV,alphas[svInd]) + b
-        if sign(predict)!=sign(labelArr[i]): errorCount += 1    
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=sign(labelArr)))
     print "the test error rate is: %f" % (float(errorCount)/m) 
 
+#read-only data shared by the training processes, opened with a memmap by initSVMWorker()
+sharedArrays = {}
+
+def initSVMWorker(dirName, quiet):
+    for name in ('X', 'labels', 'gram'):
+        path = os.path.join(dirName, name + '.npy')
+        if os.path.exists(path): sharedArrays[name] = load(path, mmap_mode='r')
+    if quiet: sys.stdout = open(os.devnull, 'w')    #smoP prints every step
+
+def trainShared(task):
+    """
+    one binary problem in a worker: class pos (+1) against class neg (-1), or against the rest when neg is None
+    returns the problem index, the support vector rows of the shared X, their alpha_i*y_i and b
+    """
+    k, pos, neg, C, toler, maxIter, kTup, cacheBytes, selection, shrinking = task
+    labels = sharedArrays['labels']; gram = sharedArrays.get('gram')
+    if neg is None:
+        rows = arange(len(labels)); X = sharedArrays['X']
+    else:   #only the two classes, gathered out of the shared arrays
+        rows = nonzero((labels == pos) | (labels == neg))[0]; X = sharedArrays['X'][rows]
+        if gram is not None: gram = gram[ix_(rows, rows)]
+    y = where(labels[rows] == pos, 1.0, -1.0)
+    b, alphas = smoP(X, y, C, toler, maxIter, kTup, cacheBytes, selection, shrinking, gram=gram)
+    sv = nonzero(alphas.A1 > 0)[0]
+    return k, rows[sv], alphas.A1[sv]*y[sv], float(b)
+
+def trainMulticlass(dataArr, labels, C, toler, maxIter, kTup=('lin', 0), strategy='ovr', numWorkers=None,
+                    cacheBytes=100*2**20, selection='platt', shrinking=False, gramBytes=512*2**20, quiet=True):
+    """
+    multiclass SVM from binary smoP problems trained in a process pool, returns a MultiSVModel
+    strategy: 'ovr' trains one problem per class against the rest, 'ovo' one per pair of classes
+    the data is written once to .npy files that every worker opens with a read-only memmap;
+    when the m x m kernel matrix fits in gramBytes it is computed once here and shared the same way,
+    so no worker computes kernel rows at all
+    numWorkers: processes, default cpu count; quiet: silence smoP's progress output in the workers
+    """
+    import multiprocessing, tempfile, shutil
+    if strategy not in ('ovr', 'ovo'): raise ValueError('unknown strategy %r' % (strategy,))
+    if selection not in ('platt', 'wss2'): raise ValueError('unknown selection %r' % (selection,))
+    if shrinking and selection != 'wss2': raise ValueError("shrinking needs selection='wss2'")
+    if numWorkers is None: numWorkers = multiprocessing.cpu_count()
+    X = asarray(dataArr, dtype=float)
+    classes, codes = unique(asarray(labels), return_inverse=True)
+    numClasses = len(classes); m = X.shape[0]
+    if numClasses < 2: raise ValueError('need at least two classes')
+    if strategy == 'ovr':
+        pairs = None
+        tasks = [(k, k, None) for k in range(numClasses)]
+    else:
+        pairs = array([(a, b) for a in range(numClasses) for b in range(a+1, numClasses)])
+        tasks = [(k, a, b) for k, (a, b) in enumerate(pairs)]
+        counts = bincount(codes)    #largest problems first so the pool does not wait on a straggler
+        tasks.sort(key=lambda t: -(counts[t[1]] + counts[t[2]]))
+    tasks = [t + (C, toler, maxIter, kTup, cacheBytes, selection, shrinking) for t in tasks]
+    tmpDir = tempfile.mkdtemp(prefix='svm')
+    try:
+        save(os.path.join(tmpDir, 'X.npy'), X)
+        save(os.path.join(tmpDir, 'labels.npy'), codes)
+        if 8*m*m <= gramBytes:   #written a block of rows at a time, never held twice
+            from numpy.lib.format import open_memmap
+            gram = open_memmap(os.path.join(tmpDir, 'gram.npy'), mode='w+', dtype=float, shape=(m, m))
+            sqNorms = (X**2).sum(axis=1)
+            blockRows = max(1, (64*2**20) // (8*m))
+            for start in range(0, m, blockRows):
+                stop = start + blockRows
+                gram[start:stop] = kernelMatrix(X[start:stop], X, kTup, sqNorms[start:stop])
+            gram.flush(); del gram
+        numProblems = len(tasks)
+        results = [None]*numProblems
+        pool = multiprocessing.Pool(min(numWorkers, numProblems), initSVMWorker, (tmpDir, quiet))
+        try:
+            for result in pool.imap_unordered(trainShared, tasks): results[result[0]] = result[1:]
+        finally:
+            pool.close(); pool.join()
+    finally:
+        shutil.rmtree(tmpDir)
+    #union of the support vectors, one column of coefficients per problem
+    svRows = unique(concatenate([rows for rows, coef, b in results]))
+    dualCoef = zeros((len(svRows), numProblems))
+    for k, (rows, coef, b) in enumerate(results): dualCoef[searchsorted(svRows, rows), k] = coef
+    return MultiSVModel(X[svRows], dualCoef, [b for rows, coef, b in results], kTup, classes, pairs)
+
+def testDigitsMulti(kTup=('rbf', 10), strategy='ovr', numWorkers=None):
+    dataArr,labelArr = loadImages('trainingDigits', binary=False)
+    model = trainMulticlass(dataArr, labelArr, 200, 0.0001, 10000, kTup, strategy, numWorkers)
+    print "there are %d Support Vectors for %d problems" % (shape(model.supportVectors)[0], len(model.b))
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=array(labelArr)))
+    print "the training error rate is: %f" % (float(errorCount)/m)
+    dataArr,labelArr = loadImages('testDigits', binary=False)
+    m,n = shape(dataArr)
+    errorCount = int(sum(model.predict(dataArr)!=array(labelArr)))
+    print "the test error rate is: %f" % (float(errorCount)/m)
+
 
 '''#######********************************
 Non-Kernel VErsions below
@@ -4,6 +4,9 @@ Adaboost is short for Adaptive Boosting
 @author: Peter
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
 
 def loadSimpData():
     datMat = matrix([[ 1. ,  2.1],
@@ -15,17 +18,7 @@ def loadSimpData():
     return datMat,classLabels
 
 def loadDataSet(fileName):      #general function to parse tab -delimited floats
-    numFeat = len(open(fileName).readline().split('\t')) #get number of fields 
-    dataMat = []; labelMat = []
-    fr = open(fileName)
-    for line in fr.readlines():
-        lineArr =[]
-        curLine = line.strip().split('\t')
-        for i in range(numFeat-1):
-            lineArr.append(float(curLine[i]))
-        dataMat.append(lineArr)
-        labelMat.append(float(curLine[-1]))
-    return dataMat,labelMat
+    return loadTabDelimited(fileName, labelCol=-1)   #last column is the label
 
 def stumpClassify(dataMatrix,dimen,threshVal,threshIneq):#just classify the data
     retArray = ones((shape(dataMatrix)[0],1))
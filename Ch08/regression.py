@@ -4,19 +4,12 @@ Created on Jan 8, 2011
 @author: Peter
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
 
 def loadDataSet(fileName):      #general function to parse tab -delimited floats
-    numFeat = len(open(fileName).readline().split('\t')) - 1 #get number of fields 
-    dataMat = []; labelMat = []
-    fr = open(fileName)
-    for line in fr.readlines():
-        lineArr =[]
-        curLine = line.strip().split('\t')
-        for i in range(numFeat):
-            lineArr.append(float(curLine[i]))
-        dataMat.append(lineArr)
-        labelMat.append(float(curLine[-1]))
-    return dataMat,labelMat
+    return loadTabDelimited(fileName, labelCol=-1)   #last column is the target value
 
 def standRegres(xArr,yArr):
     xMat = mat(xArr); yMat = mat(yArr).T
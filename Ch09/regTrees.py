@@ -4,15 +4,13 @@ Tree-Based Regression Methods
 @author: Peter Harrington
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
+from common.treeFormat import writeTreeFile, readTreeFile
 
 def loadDataSet(fileName):      #general function to parse tab -delimited floats
-    dataMat = []                #assume last column is target value
-    fr = open(fileName)
-    for line in fr.readlines():
-        curLine = line.strip().split('\t')
-        fltLine = map(float,curLine) #map all elements to float()
-        dataMat.append(fltLine)
-    return dataMat
+    return loadTabDelimited(fileName)   #assume last column is target value
 
 def binSplitDataSet(dataSet, feature, value):
     mat0 = dataSet[nonzero(dataSet[:,feature] > value)[0],:][0]
@@ -133,4 +131,46 @@ def createForeCast(tree, testData, modelEval=regTreeEval):
     yHat = mat(zeros((m,1)))
     for i in range(m):
         yHat[i,0] = treeForeCast(tree, mat(testData[i]), modelEval)
-    return yHat
\ No newline at end of file
+    return yHat
+
+def compileRegTree(tree):  #flatten the dict tree into parallel arrays
+    spInd = []; spVal = []; left = []; right = []; leaf = []; leafValues = []
+    def addNode(subTree):
+        node = len(spInd)
+        spInd.append(-1); spVal.append(0.0); left.append(-1); right.append(-1); leaf.append(-1)
+        if isTree(subTree):
+            spInd[node] = subTree['spInd']; spVal[node] = subTree['spVal']
+            left[node] = addNode(subTree['left']); right[node] = addNode(subTree['right'])
+        else:   #a mean for regression trees, a column of weights for model trees
+            leaf[node] = len(leafValues); leafValues.append(array(subTree, dtype=float).ravel())
+        return node
+    addNode(tree)
+    return {'spInd':array(spInd, dtype=int32), 'spVal':array(spVal, dtype=float64),
+            'left':array(left, dtype=int32), 'right':array(right, dtype=int32),
+            'leaf':array(leaf, dtype=int32), 'leafValues':array(leafValues, dtype=float64)}
+
+def storeRegTree(tree, fileName):  #versioned binary format, see common/treeFormat.py
+    compiled = compileRegTree(tree)
+    writeTreeFile(fileName, 'regTree', [(name, compiled[name]) for name in sorted(compiled)], {})
+
+def grabRegTree(fileName):  #memory-mapped compiled tree for createForeCastCompiled
+    meta, arrays = readTreeFile(fileName, 'regTree')
+    return arrays
+
+def createForeCastCompiled(compiled, testData, modelEval=regTreeEval):  #all rows at once
+    X = array(testData, dtype=float)
+    if X.ndim == 1: X = X.reshape(-1, 1)
+    m = X.shape[0]
+    node = zeros(m, dtype=int)
+    active = arange(m)
+    while len(active) > 0:
+        feat = compiled['spInd'][node[active]]
+        active = active[feat >= 0]; feat = feat[feat >= 0]
+        if len(active) == 0: break
+        goLeft = X[active, feat] > compiled['spVal'][node[active]]
+        node[active] = where(goLeft, compiled['left'][node[active]], compiled['right'][node[active]])
+    leafValues = compiled['leafValues'][compiled['leaf'][node]]
+    if modelEval is modelTreeEval:   #weights[0] is the intercept
+        yHat = leafValues[:, 0] + (X * leafValues[:, 1:]).sum(axis=1)
+    else: yHat = leafValues[:, 0]
+    return mat(yHat).T
@@ -118,12 +118,12 @@ def createInitSet(dataSet):
 
 import twitter
 from time import sleep
-import re
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tokenizer import tokenize
 
 def textParse(bigString):
-    urlsRemoved = re.sub('(http:[/][/]|www.)([a-z]|[A-Z]|[0-9]|[/.]|[~])*', '', bigString)    
-    listOfTokens = re.split(r'\W*', urlsRemoved)
-    return [tok.lower() for tok in listOfTokens if len(tok) > 2]
+    return tokenize(bigString, stripUrls=True)
 
 def getLotsOfTweets(searchStr):
     CONSUMER_KEY = ''
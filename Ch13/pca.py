@@ -4,12 +4,12 @@ Created on Jun 1, 2011
 @author: Peter Harrington
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
 
 def loadDataSet(fileName, delim='\t'):
-    fr = open(fileName)
-    stringArr = [line.strip().split(delim) for line in fr.readlines()]
-    datArr = [map(float,line) for line in stringArr]
-    return mat(datArr)
+    return mat(loadTabDelimited(fileName, delim=delim))
 
 def pca(dataMat, topNfeat=9999999):
     meanVals = mean(dataMat, axis=0)
@@ -5,16 +5,12 @@ the input T is k*T in Batch Pegasos
 @author: Peter Harrington
 '''
 from numpy import *
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tabLoader import loadTabDelimited
 
 def loadDataSet(fileName):
-    dataMat = []; labelMat = []
-    fr = open(fileName)
-    for line in fr.readlines():
-        lineArr = line.strip().split('\t')
-        #dataMat.append([float(lineArr[0]), float(lineArr[1]), float(lineArr[2])])
-        dataMat.append([float(lineArr[0]), float(lineArr[1])])
-        labelMat.append(float(lineArr[2]))
-    return dataMat,labelMat
+    return loadTabDelimited(fileName, usecols=[0, 1], labelCol=2)
 
 def seqPegasos(dataSet, labels, lam, T):
     m,n = shape(dataSet); w = zeros(n)
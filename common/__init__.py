@@ -0,0 +1,6 @@
+'''
+Helpers shared by the chapter modules.
+
+The chapter modules put the repository root on sys.path and import from here,
+e.g. from common.tabLoader import loadTabDelimited
+'''
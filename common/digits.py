@@ -0,0 +1,47 @@
+'''
+Packed storage for the 32x32 handwritten digit files (Ch02 kNN, Ch06 svmMLiA).
+
+packDigits converts a directory of digit text files once: the 1024 0/1 pixels
+of every sample are packed into 128 bytes with packbits and written to
+<prefix>Bits.npy, the digits to <prefix>Labels.npy. loadPackedDigits reads
+them back with a memmap instead of opening every text file and calling int()
+per character. Files are taken in sorted name order, like the chapters'
+text loaders, so both give the same rows.
+'''
+from numpy import *
+import os
+
+def packDigits(dirName, outPrefix=None):
+    '''
+    dirName:   a directory like trainingDigits or testDigits
+    outPrefix: prefix of the output files, default the directory name
+    returns the prefix
+    '''
+    if outPrefix is None: outPrefix = dirName.rstrip('/\\')
+    fileList = sorted(os.listdir(dirName))
+    m = len(fileList)
+    pixels = zeros((m,1024), dtype=uint8)
+    hwLabels = zeros(m, dtype=uint8)
+    for i in range(m):
+        fileNameStr = fileList[i]
+        hwLabels[i] = int(fileNameStr.split('.')[0].split('_')[0])
+        raw = frombuffer(open('%s/%s' % (dirName, fileNameStr), 'rb').read(), dtype=uint8)
+        digits = raw[(raw == ord('0')) | (raw == ord('1'))]    #drop the line breaks
+        if len(digits) != 1024:
+            raise ValueError('%s is not a 32x32 digit file' % fileNameStr)
+        pixels[i,:] = digits - ord('0')
+    save(outPrefix + 'Bits.npy', packbits(pixels, axis=1))
+    save(outPrefix + 'Labels.npy', hwLabels)
+    return outPrefix
+
+def loadPackedDigits(prefix, unpack=True):
+    '''
+    prefix: the prefix given to packDigits
+    unpack: True returns an m x 1024 float matrix and a list of digits, the same rows as
+            reading the text files in sorted order; False returns the memmapped
+            m x 128 byte matrix and label array as they are
+    '''
+    bits = load(prefix + 'Bits.npy', mmap_mode='r')
+    hwLabels = load(prefix + 'Labels.npy', mmap_mode='r')
+    if not unpack: return bits, hwLabels
+    return unpackbits(bits, axis=1).astype(float), hwLabels.tolist()
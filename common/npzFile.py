@@ -0,0 +1,11 @@
+'''
+File name handling for the models saved with numpy.savez (Ch02 Normalizer, Ch06 SVModel).
+'''
+
+def npzName(fileName):
+    '''
+    the name savez actually writes: it appends .npz to names without it, so
+    load(npzName(name)) reads back what save(name) wrote; open files pass through
+    '''
+    if isinstance(fileName, basestring) and not fileName.endswith('.npz'): return fileName + '.npz'
+    return fileName
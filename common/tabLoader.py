@@ -0,0 +1,80 @@
+'''
+Single-pass loader for the tab-delimited numeric files used throughout the book.
+
+The file is read in chunks of lines; every chunk is parsed by numpy in C and
+copied straight into a growable array, so there is never a list of lists of
+Python floats sitting in memory next to the final matrix.
+'''
+from numpy import *
+from itertools import islice
+
+def checkFields(line, delim, numCols):
+    numFields = len(line.split()) if delim is None else line.count(delim) + 1
+    if numFields != numCols:
+        raise ValueError('expected %d fields, got %d: %r' % (numCols, numFields, line))
+
+def parseChunk(lines, delim, numCols):
+    for line in lines: checkFields(line, delim, numCols)
+    if delim is not None and any((' ' in line and delim != ' ') or delim + delim in line for line in lines):
+        #spaces inside a field or empty fields would shift values between rows in the fast
+        #path below; parse field by field, which accepts padded numbers and raises on the rest
+        return array([map(float, line.split(delim)) for line in lines], dtype=float64)
+    if delim is not None: text = ' '.join(lines).replace(delim, ' ')
+    else: text = ' '.join(lines)
+    values = fromstring(text, dtype=float64, sep=' ')
+    if len(values) != len(lines) * numCols:
+        for line in lines: map(float, line.split(delim))    #report the field that is not a number
+        raise ValueError('could not parse chunk as %d numeric columns' % numCols)
+    return values.reshape(len(lines), numCols)
+
+def loadTabDelimited(fileName, usecols=None, labelCol=None, dtype=float64, delim='\t',
+                     labelDtype=float64, chunkLines=65536):
+    '''
+    Load a delimited file of numbers into an array in one pass.
+
+    fileName:   path or open file
+    usecols:    list of column indices to keep, default all (except labelCol)
+    labelCol:   index of the label column (may be negative, e.g. -1);
+                when given the labels are returned as a separate 1-D array
+    dtype:      dtype of the returned data matrix
+    delim:      field separator, None for any whitespace; every line must have the same
+                number of fields, otherwise ValueError
+    labelDtype: dtype of the returned label array
+    chunkLines: number of lines parsed per chunk
+
+    returns data, or data,labels when labelCol is given
+    '''
+    if hasattr(fileName, 'read'): fr = fileName
+    else: fr = open(fileName)
+    numCols = None; numRows = 0
+    dataMat = None; labels = None
+    while True:
+        lines = [line.strip() for line in islice(fr, chunkLines)]
+        if len(lines) == 0: break
+        lines = [line for line in lines if line]
+        if len(lines) == 0: continue
+        if numCols is None:   #first chunk fixes the layout
+            numCols = len(lines[0].split(delim))
+            if labelCol is not None: labelCol = range(numCols)[labelCol]
+            if usecols is None:
+                usecols = [i for i in range(numCols) if i != labelCol]
+            else: usecols = [range(numCols)[i] for i in usecols]
+            dataMat = zeros((len(lines), len(usecols)), dtype=dtype)
+            labels = zeros(len(lines), dtype=labelDtype)
+        chunk = parseChunk(lines, delim, numCols)
+        n = chunk.shape[0]
+        if numRows + n > dataMat.shape[0]:   #grow geometrically, realloc in place when possible
+            newSize = max(numRows + n, 2 * dataMat.shape[0])
+            dataMat.resize((newSize, dataMat.shape[1]), refcheck=False)
+            labels.resize(newSize, refcheck=False)
+        dataMat[numRows:numRows + n] = chunk[:, usecols]
+        if labelCol is not None: labels[numRows:numRows + n] = chunk[:, labelCol]
+        numRows += n
+    if fr is not fileName: fr.close()
+    if dataMat is None:
+        dataMat = zeros((0, 0 if usecols is None else len(usecols)), dtype=dtype)
+        labels = zeros(0, dtype=labelDtype)
+    dataMat.resize((numRows, dataMat.shape[1]), refcheck=False)   #release the spare capacity
+    labels.resize(numRows, refcheck=False)
+    if labelCol is None: return dataMat
+    return dataMat, labels
@@ -0,0 +1,83 @@
+'''
+Tokenizer shared by the text chapters (Ch04 bayes, Ch12 fpGrowth).
+
+Tokens follow the book's textParse: split on non-word characters, lowercase,
+keep tokens longer than two characters. The patterns are compiled once at
+import. Files are tokenized line by line and corpora are tokenized in a
+process pool with a bounded number of documents in flight, so nothing has
+to hold a whole archive in memory.
+'''
+import re
+import os
+from itertools import islice
+
+nonWord = re.compile(r'\W+')
+urlPattern = re.compile('(http:[/][/]|www.)([a-z]|[A-Z]|[0-9]|[/.]|[~])*')
+
+def tokenize(text, stripUrls=False, minLen=3):
+    if stripUrls: text = urlPattern.sub('', text)
+    return [tok.lower() for tok in nonWord.split(text) if len(tok) >= minLen]
+
+def iterTokens(fileName, stripUrls=False, minLen=3):
+    '''
+    generator over the tokens of a file, read one line at a time
+    gives the same tokens as tokenize(open(fileName).read()) since newlines
+    separate tokens and urls never span lines
+    '''
+    fr = open(fileName)
+    try:
+        for line in fr:
+            for tok in tokenize(line, stripUrls, minLen): yield tok
+    finally:
+        fr.close()
+
+def tokenizeFile(fileName, stripUrls=False, minLen=3):
+    return list(iterTokens(fileName, stripUrls, minLen))
+
+def tokenizeFileArgs(args):    #pool worker, must be importable
+    fileName, stripUrls, minLen = args
+    return fileName, tokenizeFile(fileName, stripUrls, minLen)
+
+def listCorpus(dirNames):
+    '''
+    generator over the files in the given directories, sorted by name per directory
+    '''
+    if isinstance(dirNames, basestring): dirNames = [dirNames]
+    for dirName in dirNames:
+        for name in sorted(os.listdir(dirName)):
+            path = os.path.join(dirName, name)
+            if os.path.isfile(path): yield path
+
+def tokenizeFiles(fileNames, numWorkers=None, batchSize=64, stripUrls=False, minLen=3):
+    '''
+    generator of (fileName, tokens) in the order of fileNames
+    fileNames:  any iterable, consumed lazily
+    numWorkers: processes in the pool, default cpu count; 1 tokenizes in this process
+    batchSize:  documents per worker per batch; at most two batches are in memory
+    '''
+    from multiprocessing import Pool, cpu_count
+    if numWorkers is None: numWorkers = cpu_count()
+    args = ((fileName, stripUrls, minLen) for fileName in fileNames)
+    if numWorkers <= 1:
+        for arg in args: yield tokenizeFileArgs(arg)
+        return
+    pool = Pool(numWorkers)
+    try:
+        batch = list(islice(args, numWorkers * batchSize))
+        pending = pool.map_async(tokenizeFileArgs, batch, batchSize) if batch else None
+        while pending is not None:
+            #submit the next batch before handing out this one so the workers never idle
+            batch = list(islice(args, numWorkers * batchSize))
+            results = pending.get()
+            pending = pool.map_async(tokenizeFileArgs, batch, batchSize) if batch else None
+            for result in results: yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def readCorpus(dirNames, numWorkers=None, batchSize=64, stripUrls=False, minLen=3):
+    '''
+    generator of (fileName, tokens) for every file in the given directories
+    '''
+    return tokenizeFiles(listCorpus(dirNames), numWorkers, batchSize, stripUrls, minLen)
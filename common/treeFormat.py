@@ -0,0 +1,90 @@
+'''
+Compact binary container for trees flattened into arrays.
+
+Layout (all integers little-endian):
+    8 bytes   magic 'MLTREE\0\0'
+    uint32    format version
+    uint32    length of the JSON header in bytes
+    header    JSON: {"kind": ..., "meta": {...}, "arrays": [{"name", "dtype", "shape", "offset"}]}
+    arrays    raw C-order array data, each starting on an 8 byte boundary
+
+Nothing is unpickled: the header is plain JSON and the arrays are read with
+a read-only memmap, so a large tree can be used for prediction straight from
+the page cache without building any Python objects per node.
+'''
+from numpy import *
+import json
+import struct
+
+MAGIC = 'MLTREE\0\0'
+VERSION = 2    #2: id3 children stored CSR-style instead of a dense table
+allowedDtypes = ('|i1', '<i2', '<i4', '<i8', '<f8', '|u1')
+
+def align8(n):
+    return (n + 7) // 8 * 8
+
+def writeTreeFile(fileName, kind, arrays, meta):
+    '''
+    kind:   string naming the tree type, checked by readTreeFile
+    arrays: list of (name, ndarray) pairs
+    meta:   JSON serializable dict with the non-array parts of the tree
+    '''
+    arrays = [(name, ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<')))
+              for name, arr in arrays]
+    specs = []
+    for name, arr in arrays:
+        if arr.dtype.str not in allowedDtypes:
+            raise ValueError('unsupported dtype %s for %s' % (arr.dtype, name))
+        specs.append({'name': name, 'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': 0})
+    #offsets depend on the header length, which depends on the offsets: fix the width first
+    for spec in specs: spec['offset'] = 10 ** 15
+    headerLen = len(json.dumps({'kind': kind, 'meta': meta, 'arrays': specs}))
+    offset = align8(16 + headerLen)
+    for spec, (name, arr) in zip(specs, arrays):
+        spec['offset'] = offset
+        offset = align8(offset + arr.nbytes)
+    header = json.dumps({'kind': kind, 'meta': meta, 'arrays': specs})
+    header += ' ' * (headerLen - len(header))
+    fw = open(fileName, 'wb')
+    fw.write(MAGIC + struct.pack('<II', VERSION, headerLen) + header)
+    for spec, (name, arr) in zip(specs, arrays):
+        fw.write('\0' * (spec['offset'] - fw.tell()))
+        fw.write(arr.tostring())
+    fw.close()
+
+def plainStrings(obj):    #json gives unicode; keep ascii text as str like the rest of the code
+    if isinstance(obj, unicode):
+        try: return str(obj)
+        except UnicodeEncodeError: return obj
+    if isinstance(obj, list): return [plainStrings(item) for item in obj]
+    if isinstance(obj, dict): return dict((plainStrings(k), plainStrings(v)) for k, v in obj.items())
+    return obj
+
+def readTreeFile(fileName, kind):
+    '''
+    returns meta, arrays; arrays is a dict of read-only arrays backed by a memmap
+    raises ValueError if the file is not a tree file of the given kind
+    '''
+    fr = open(fileName, 'rb')
+    prefix = fr.read(16)
+    if len(prefix) < 16 or prefix[:8] != MAGIC:
+        raise ValueError('%s is not a tree file' % fileName)
+    version, headerLen = struct.unpack('<II', prefix[8:])
+    if version != VERSION:
+        raise ValueError('unsupported tree file version %d' % version)
+    header = json.loads(fr.read(headerLen))
+    fr.close()
+    if header['kind'] != kind:
+        raise ValueError('%s holds a %s tree, not %s' % (fileName, header['kind'], kind))
+    buf = memmap(fileName, dtype=uint8, mode='r')
+    arrays = {}
+    for spec in header['arrays']:
+        dt = dtype(str(spec['dtype']))
+        if dt.str not in allowedDtypes:
+            raise ValueError('unsupported dtype %s' % spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(prod(shape)) if len(shape) > 0 else 1
+        if spec['offset'] < 16 + headerLen or spec['offset'] + count * dt.itemsize > len(buf):
+            raise ValueError('array %s lies outside of %s' % (spec['name'], fileName))
+        arrays[str(spec['name'])] = ndarray(shape, dtype=dt, buffer=buf, offset=spec['offset'])
+    return plainStrings(header['meta']), arrays